@@ -5,8 +5,46 @@
 
 #from IPython.display import clear_output                                # Somente necessário em ambiente Colab
 import json
+import sqlite3
+import hashlib
+import sys
 import random
 import os
+import heapq
+import bisect
+import time
+import itertools
+import multiprocessing
+import threading
+import argparse
+import copy
+import math
+import pathlib
+import signal
+import socket
+import tempfile
+import codecs
+import io
+import re
+import mmap
+import struct
+import zlib
+from array import array
+import contextlib
+from collections import OrderedDict
+from operator import itemgetter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import numpy as np  # Opcional: habilita o backend vetorizado do motor de inferência
+except ImportError:
+    np = None  # Sem NumPy, o motor usa apenas o caminho em Python puro
+
+try:
+    import fcntl  # Travas de arquivo no Unix
+except ImportError:
+    fcntl = None
+    import msvcrt  # Travas de arquivo no Windows
 
 # Função para limpar a tela, diferente para Windows e Unix/Linux
 def clear():
@@ -14,40 +52,582 @@ def clear():
     os.system("cls" if os.name == "nt" else "clear")
     print("Sistema Especialista - Diagnóstico de Falhas em Computadores")
 
+# Funções para travar e liberar um arquivo aberto entre processos (trava consultiva exclusiva), diferentes para
+# Windows (msvcrt, trava do primeiro byte) e Unix/Linux (fcntl.flock). Esperam até a trava ser liberada.
+def lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # Desiste após ~10 s: tenta de novo
+            return
+        except OSError:
+            pass
+
+def unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+# Gravação atômica de arquivo: o conteúdo vai para um arquivo temporário com nome único no mesmo diretório (dois
+# processos gravando o mesmo arquivo não usam o mesmo temporário) e substitui o destino com os.replace,
+# mantendo as permissões do arquivo anterior. Se a gravação falhar, o temporário é removido.
+@contextlib.contextmanager
+def atomic_write(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644  # mkstemp cria o temporário com 0600
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
 # Persistência dos dados / Base de conhecimento
 # Esta classe gerencia os arquivos de dados (base de conhecimento e histórico de feedback)
+# Vários processos (terminais) podem gravar feedback no mesmo histórico JSON. Cada processo tem seus próprios
+# contadores de sucesso e falha por regra, que só crescem; cada linha do log de feedback traz o valor atual
+# dos contadores do processo para a regra, e a junção de linhas e estados é o máximo por processo e regra
+# (comutativa e idempotente, como em um CRDT G-Counter). O estado compartilhado (history.state.json) guarda
+# a base já compactada e os contadores ainda não incorporados a ela; o history.json traz os totais. As
+# gravações no log e a compactação usam uma trava de arquivo (history.lock), então nenhum feedback se perde.
 
 class Persistence:
-    def __init__(self, kb_file='kb.json', history_file='history.json'):
+    def __init__(self, kb_file='kb.json', history_file='history.json', log_file=None, compact_every=10000,
+                 backend="json", db_file='kb.db', write_behind=False, flush_interval=0.05, flush_threshold=256,
+                 fsync=None, compiled_kb=True, read_only=False, writer_id=None):
+
+        # :param log_file: Log de feedback (padrão: o nome do histórico com extensão .log, ex.: history.log).
+        # :param compact_every: Número de eventos no log a partir do qual o histórico é compactado.
+        # :param backend: "json" (padrão: kb.json + history.json + log de feedback) ou "sqlite" (banco único, veja SQLiteStore).
+        # :param db_file: Arquivo do banco SQLite (apenas no backend "sqlite").
+        # :param write_behind: Se True, record_feedback apenas enfileira os eventos; uma thread de gravação os
+        #                      agrupa e grava a cada `flush_interval` segundos ou quando a fila chega a `flush_threshold`.
+        # :param fsync: Política de fsync das gravações: "always" (a cada gravação), "never", um número de milissegundos
+        #               (no máximo um fsync por intervalo) ou None (padrão: sem fsync explícito, como antes).
+        #               No SQLite, vira PRAGMA synchronous = FULL / OFF / NORMAL (None mantém o padrão do banco).
+        # :param compiled_kb: Se True (backend "json"), abre a base compilada em arquivo (veja CompiledKB) e só
+        #                     interpreta o kb.json quando a base em dicionários for usada (atributo `kb`). A base
+        #                     compilada é gerada com leitura incremental do kb.json (veja KBRecordStream).
+        # :param read_only: Se True, nada é gravado no disco (para execuções que só consultam, como o diagnóstico em
+        #                   lote): arquivos ausentes não são criados (a base padrão fica só em memória), o log não é
+        #                   reiniciado nem truncado e o kb.bin desatualizado é compilado em memória. As operações
+        #                   de gravação levantam RuntimeError.
+        # :param writer_id: Identificação deste processo nos contadores do histórico (padrão: máquina, PID e um
+        #                   sufixo aleatório). Deve ser única entre os processos que gravam ao mesmo tempo.
+
         self.kb_file = kb_file         # Arquivo da base de conhecimento (KB)
         self.history_file = history_file # Arquivo do histórico de diagnósticos
-        self.kb = {"symptoms": [], "solutions": [], "rules": []}  # Estrutura da base de conhecimento
-        self.history = {}  # Histórico de feedback
+        self.log_file = log_file or os.path.splitext(history_file)[0] + ".log"  # Log de eventos de feedback (só acrescenta)
+        self.state_file = os.path.splitext(history_file)[0] + ".state.json"  # Estado compartilhado entre processos
+        self.lock_file = os.path.splitext(history_file)[0] + ".lock"  # Arquivo da trava entre processos
+        self.writer_id = writer_id or f"{socket.gethostname()}:{os.getpid()}:{os.urandom(3).hex()}"
+        self._counters = {}  # Contadores deste processo ainda não incorporados à base: ID da regra -> sucesso/falha
+        self._lock_handle = None  # Arquivo da trava, aberto na primeira gravação
+        self._lock_depth = 0  # Profundidade de blocos _file_lock() ativos
+        self.compact_every = compact_every
+        self.backend = backend
+        self.read_only = read_only
+        self.store = SQLiteStore(db_file, read_only) if backend == "sqlite" else None  # Banco SQLite (backend "sqlite")
+        self.compiled_kb = compiled_kb and self.store is None
+        self.compiled = None  # Base compilada em arquivo (CompiledKB), aberta com mmap
+        self._kb = {"symptoms": [], "solutions": [], "rules": []}  # Estrutura da base de conhecimento
+        self._history = None  # Histórico de feedback, carregado no primeiro acesso (veja load_history)
+        self.log_events = 0  # Eventos no log ainda não compactados no arquivo de histórico
+        self._log = None  # Arquivo do log aberto para acréscimo
+        self.dirty = set()  # Partes alteradas desde a última gravação: "kb" e/ou "history"
+        self._saved_sizes = None  # Tamanho das listas da base na última gravação (a base só cresce pela aplicação)
+        self._deferred = 0  # Profundidade de blocos deferred() ativos
+        self._save_pending = False  # save_all() chamado dentro de um bloco deferred()
+        self.fsync = fsync
+        self._io_lock = threading.RLock()  # Serializa as gravações entre a thread de gravação e quem chama
+        self._unsynced = False  # Há dados gravados no log ainda sem fsync (política por intervalo)
+        self._last_sync = time.monotonic()
+        self._queue = []  # Eventos de feedback aguardando a thread de gravação
+        self._queue_ready = threading.Condition()  # Sinaliza a fila cheia ou o encerramento
+        self._writer = None  # Thread de gravação (modo write-behind)
+        self._closing = False
+        if self.store is not None and fsync is not None and not read_only:
+            self.store.set_synchronous({"always": "FULL", "never": "OFF"}.get(fsync, "NORMAL"))
         self.load_all()  # Carrega os dados existentes, se houver
+        if write_behind:
+            self.flush_interval = flush_interval
+            self.flush_threshold = flush_threshold
+            self._writer = threading.Thread(target=self._write_behind, name="persistence-writer", daemon=True)
+            self._writer.start()
 
     def load_all(self):
-        # Se os arquivos não existirem, cria um padrão
-        if not os.path.exists(self.kb_file):
-            self._create_default_kb()
-        if not os.path.exists(self.history_file):
-            with open(self.history_file, 'w') as f:
-                json.dump({}, f, indent=2)  # Cria o arquivo de histórico vazio
+        if self.store is not None:
+            if self.store.is_empty():
+                self._create_default_kb()  # Banco novo: importa a base padrão
+            self.kb = self.store.load_kb()
+            self._mark_saved()
+            return
 
-        # Carrega a base de conhecimento e o histórico dos arquivos JSON
-        with open(self.kb_file, 'r') as f:
-            self.kb = json.load(f)
-        with open(self.history_file, 'r') as f:
-            self.history = json.load(f)
+        # Se a base não existir, cria uma padrão (no modo somente leitura, apenas em memória)
+        if not os.path.exists(self.kb_file):
+            kb = self._create_default_kb()
+            if self.read_only:
+                self.kb = kb
+                self._mark_saved()
+                return
+
+        # Carrega a base de conhecimento do arquivo JSON; o histórico só é lido no primeiro acesso (load_history)
+        if self.compiled_kb:
+            self.compiled = CompiledKB.open(self.kb_file, write=not self.read_only)  # Gera o kb.bin de novo se o kb.json mudou
+            self._kb = None  # O kb.json só é interpretado no primeiro acesso a `kb`
+        else:
+            with open(self.kb_file, 'r') as f:
+                self.kb = json.load(f)
+        self._mark_saved()
+
+    def load_history(self):
+
+        # Retorna o histórico de feedback, carregando-o na primeira chamada: os totais do estado compartilhado
+        # e do log de feedback de todos os processos (veja _load_state).
+        # O motor de inferência pode receber este método no lugar do histórico (carga sob demanda).
+
+        with self._io_lock:
+            if self._history is not None:
+                return self._history
+            if self.store is not None:
+                self._history = self.store.load_history()
+                return self._history
+            with self._file_lock():
+                state = self._load_state()
+            # Com uma identificação fixa, os contadores continuam de onde a execução anterior parou
+            self._counters = copy.deepcopy(state["writers"].get(self.writer_id, {}))
+            self._history = self._totals(state)
+            return self._history
+
+    @property
+    def history(self):
+        return self.load_history()
+
+    @history.setter
+    def history(self, history):
+        self._history = history
+
+    @property
+    def kb(self):
+
+        # Base de conhecimento em dicionários. Com a base compilada, é carregada do kb.json no primeiro acesso
+        # (o mesmo objeto usado pelo motor montado a partir de `compiled`).
+
+        if self._kb is None and self.compiled is not None:
+            self._kb = self.compiled.load_kb()
+        return self._kb
+
+    @kb.setter
+    def kb(self, kb):
+        self._kb = kb
 
     def save_all(self):
-        # Salva os dados atualizados da base de conhecimento e histórico
-        with open(self.kb_file, 'w') as f:
-            json.dump(self.kb, f, indent=2, ensure_ascii=False)
-        with open(self.history_file, 'w') as f:
-            json.dump(self.history, f, indent=2, ensure_ascii=False)
+        # Salva os dados atualizados da base de conhecimento e histórico.
+        # Só grava o que mudou: a base, se foi marcada como alterada ou ganhou registros, e o histórico, se foi
+        # marcado como alterado ou há eventos no log ainda não compactados. Dentro de um bloco deferred(),
+        # apenas agenda uma gravação para o fim do bloco.
+        # No modo write-behind, os eventos ainda na fila são gravados antes (de forma síncrona).
+        if self._deferred:
+            self._save_pending = True
+            return
+
+        self._check_writable()
+        with self._io_lock:
+            self.flush()
+            if self._kb is None and self.compiled is not None and self.compiled._kb is not None:
+                self._kb = self.compiled._kb  # Carregada (e talvez alterada) pelo motor montado a partir de `compiled`
+            # Uma base que nunca foi carregada em dicionários não pode ter mudado
+            kb_changed = self._kb is not None and ("kb" in self.dirty or self._kb_sizes() != self._saved_sizes)
+            if self.store is not None:
+                if "kb" in self.dirty:
+                    self.store.replace_kb(self.kb)  # Registros existentes podem ter sido editados (mark_dirty)
+                elif kb_changed:
+                    self.store.sync_kb(self.kb)  # Só os registros novos; o feedback já foi gravado em record_feedback
+                if "history" in self.dirty:
+                    self.compact()
+            else:
+                if kb_changed:
+                    self._replace(self.kb_file, json.dumps(self.kb, indent=2, ensure_ascii=False).encode('utf-8'))
+                if "history" in self.dirty or self.log_events:
+                    self.compact()
+            self._mark_saved()
+
+    def mark_dirty(self, *parts):
+
+        # Marca partes dos dados como alteradas ("kb" e/ou "history"; sem argumentos, ambas), para alterações
+        # feitas fora de record_feedback e que não acrescentam registros à base (ex.: editar uma regra existente).
+
+        self.dirty.update(parts or ("kb", "history"))
+
+    @contextlib.contextmanager
+    def deferred(self):
+
+        # Agrupa as chamadas a save_all() feitas dentro do bloco em uma única gravação, no fim do bloco.
+
+        self._deferred += 1
+        try:
+            yield self
+        finally:
+            self._deferred -= 1
+            if not self._deferred and self._save_pending:
+                self._save_pending = False
+                self.save_all()
+
+    def _kb_sizes(self):
+        return tuple(len(self.kb[part]) for part in ("symptoms", "solutions", "rules"))
+
+    def _mark_saved(self):
+        if self._kb is not None:
+            self._saved_sizes = self._kb_sizes()
+        elif self.compiled is not None:
+            # Base ainda não carregada em dicionários: os tamanhos vêm das seções da base compilada
+            self._saved_sizes = (len(self.compiled.sym_id), len(self.compiled.sol_id), len(self.compiled.rule_id))
+        else:
+            self._saved_sizes = None
+        self.dirty.clear()
+
+    def record_feedback(self, updates):
+
+        # Registra feedbacks no log de eventos (uma linha compacta por evento, apenas acrescentada ao arquivo),
+        # em vez de regravar o histórico inteiro. O histórico em memória já deve ter sido atualizado pelo motor.
+        # Quando o log passa de `compact_every` eventos, o histórico é compactado.
+        # No modo write-behind, os eventos só são enfileirados; a thread de gravação os grava depois.
+        # :param updates: Lista de tuplas (rule_id, success, penalty_factor), as mesmas passadas ao motor.
+
+        self._check_writable()
+        self.load_history()  # O log só pode receber eventos depois de reaplicado (ou reiniciado)
+        ts = round(time.time(), 3)
+        events = [(rule_id, bool(success), 1 if success else penalty_factor, ts)  # Peso: incremento do contador
+                  for rule_id, success, penalty_factor in updates]
+        if self._writer is not None:
+            with self._queue_ready:
+                self._queue.extend(events)
+                if len(self._queue) >= self.flush_threshold:
+                    self._queue_ready.notify()
+        else:
+            with self._io_lock:
+                self._write_events(events)
+        if self.store is None and self.log_events + len(self._queue) >= self.compact_every:
+            self.compact()
+
+    def flush(self, sync=True):
+
+        # Grava imediatamente os eventos que aguardam na fila do modo write-behind.
+        # :param sync: Se True, aplica também o fsync pendente, mesmo antes do fim do intervalo da política.
+
+        with self._io_lock:
+            with self._queue_ready:
+                events, self._queue = self._queue, []
+            if events:
+                self._write_events(events)
+            self._maybe_sync(force=sync)
+
+    def close(self):
+
+        # Encerra a thread de gravação, grava o que estiver pendente e fecha os arquivos.
+
+        if self._writer is not None:
+            with self._queue_ready:
+                self._closing = True
+                self._queue_ready.notify()
+            self._writer.join()
+            self._writer = None
+        with self._io_lock:
+            self.flush()
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            if self._lock_handle is not None:
+                self._lock_handle.close()
+                self._lock_handle = None
+            if self.store is not None:
+                self.store.close()
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError("Persistência aberta somente para leitura")
+
+    def _write_behind(self):
+
+        # Laço da thread de gravação: agrupa os eventos da fila e os grava a cada intervalo ou quando a fila enche.
+
+        while True:
+            with self._queue_ready:
+                self._queue_ready.wait_for(lambda: self._closing or len(self._queue) >= self.flush_threshold,
+                                           timeout=self.flush_interval)
+                if self._closing:
+                    return  # close() grava o que restou
+            self.flush(sync=False)  # O fsync segue o intervalo da política
+
+    def _write_events(self, events):
+
+        # Grava eventos de feedback: no log (uma única escrita) ou no banco (uma única transação).
+        # Deve ser chamado com self._io_lock.
+
+        if self.store is not None:
+            self.store.add_feedback([(rule_id, success, weight) for rule_id, success, weight, _ in events])
+            return
+        lines = []
+        for rule_id, success, weight, ts in events:
+            rid = str(rule_id)
+            counters = self._counters.setdefault(rid, {"success": 0, "fail": 0})
+            counters["success" if success else "fail"] += weight
+            # Linha: regra, processo e o valor atual dos contadores do processo para a regra
+            lines.append(json.dumps([rid, self.writer_id, counters["success"], counters["fail"], ts],
+                                    separators=(',', ':')) + "\n")
+        with self._file_lock():
+            self._open_log()
+            if not self._ends_with_newline():
+                lines.insert(0, "\n")  # Encerra a linha de uma gravação interrompida, que será ignorada ao carregar
+            self._log.write("".join(lines))
+            self._log.flush()
+        self.log_events += len(events)
+        self._unsynced = True
+        self._maybe_sync()
+
+    def _open_log(self):
+
+        # Abre o log para acréscimo, ou o reabre se outro processo o substituiu (compactação).
+        # Deve ser chamado com a trava de arquivo.
+
+        if self._log is not None:
+            try:
+                replaced = not os.path.samestat(os.fstat(self._log.fileno()), os.stat(self.log_file))
+            except OSError:
+                replaced = True
+            if replaced:
+                self._log.close()
+                self._log = None
+                self.log_events = 0  # Os eventos do log antigo já foram compactados pelo outro processo
+        if self._log is None:
+            self._log = open(self.log_file, 'a', encoding='utf-8')
+
+    def _ends_with_newline(self):
+
+        # Indica se o log está vazio ou termina com quebra de linha (outro processo pode ter parado no meio de
+        # uma linha). Deve ser chamado com a trava de arquivo.
+
+        size = os.fstat(self._log.fileno()).st_size
+        if not size:
+            return True
+        with open(self.log_file, 'rb') as f:
+            f.seek(size - 1)
+            return f.read(1) == b"\n"
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+
+        # Trava de arquivo entre processos (reentrante no mesmo processo). Deve ser chamado com self._io_lock.
+        # No modo somente leitura, não trava nem cria o arquivo da trava.
+
+        if not self._lock_depth and not self.read_only:
+            if self._lock_handle is None:
+                self._lock_handle = open(self.lock_file, 'a+b')
+            lock_file(self._lock_handle)
+        self._lock_depth += 1
+        try:
+            yield
+        finally:
+            self._lock_depth -= 1
+            if not self._lock_depth and not self.read_only:
+                unlock_file(self._lock_handle)
+
+    def _maybe_sync(self, force=False):
+
+        # Aplica o fsync do log conforme a política: sempre, ou quando o intervalo configurado já passou.
+
+        if not self._unsynced or self.fsync is None or self.fsync == "never":
+            return
+        if force or self.fsync == "always" or time.monotonic() - self._last_sync >= self.fsync / 1000:
+            if self._log is not None:
+                os.fsync(self._log.fileno())
+            self._unsynced = False
+            self._last_sync = time.monotonic()
+
+    def compact(self):
+
+        # Grava o histórico completo (snapshot) e reinicia o log de feedback.
+        # No backend JSON, sob a trava de arquivo: relê o estado compartilhado e o log (com o feedback de todos os
+        # processos), incorpora à base os contadores deste processo, grava o estado e os totais (history.json) e
+        # reinicia o log. O cabeçalho do novo log guarda o hash do estado: se o programa parar entre a gravação do
+        # estado e a do log, o log antigo (já incluído no estado) tem outro hash e é descartado ao carregar.
+        # Se o histórico foi marcado como alterado (mark_dirty), o histórico em memória substitui o estado.
+        # No backend SQLite, o feedback já está no banco (UPSERTs de record_feedback): o histórico só é regravado
+        # se foi marcado como alterado, para não descartar o feedback gravado por outros processos.
+
+        self._check_writable()
+        with self._io_lock:
+            self.flush()  # Os eventos ainda na fila precisam estar no log relido abaixo
+            if self.store is not None:
+                if "history" in self.dirty:
+                    self.dirty.discard("history")
+                    self.store.save_history(self.history)  # Regrava o histórico inteiro no banco
+                return
+            with self._file_lock():
+                if "history" in self.dirty:
+                    state = {"base": self.history, "writers": {}}
+                else:
+                    state = self._load_state()
+                    counters = state["writers"].pop(self.writer_id, {})
+                    for rid, data in self._counters.items():
+                        # Os contadores em memória valem mesmo que uma linha deste processo no log tenha se perdido
+                        self._merge(counters, rid, data["success"], data["fail"])
+                    self._add(state["base"], counters)
+                self._counters = {}  # Contadores deste processo recomeçam do zero sobre a nova base
+                data = json.dumps(state, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+                self._replace(self.state_file, data)
+                self._replace(self.history_file,
+                              json.dumps(self._totals(state), indent=2, ensure_ascii=False).encode('utf-8'))
+                self._reset_log(self._digest(data))
+            self.dirty.discard("history")
+
+    def _load_state(self):
+
+        # Lê o estado do histórico: o arquivo de estado (ou, se ainda não existir, o history.json como base,
+        # criado vazio se não existir e a persistência não for somente leitura) e reaplica o log de feedback.
+        # Deve ser chamado com a trava de arquivo.
+        # :return: Estado {"base": histórico, "writers": {processo: contadores}}.
+
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'rb') as f:
+                data = f.read()
+            state = json.loads(data)
+        else:
+            if os.path.exists(self.history_file):
+                with open(self.history_file, 'rb') as f:
+                    data = f.read()
+            else:
+                data = json.dumps({}, indent=2).encode('utf-8')
+                if not self.read_only:
+                    with open(self.history_file, 'wb') as f:
+                        f.write(data)  # Cria o arquivo de histórico vazio
+            state = {"base": json.loads(data), "writers": {}}
+        self._replay_log(state, self._digest(data))  # Reaplica o feedback registrado depois do último estado
+        return state
+
+    @staticmethod
+    def _merge(counters, rid, success, fail):
+
+        # Junta valores dos contadores de um processo para uma regra: fica o maior valor de cada um.
+
+        entry = counters.setdefault(rid, {"success": 0, "fail": 0})
+        entry["success"] = max(entry["success"], success)
+        entry["fail"] = max(entry["fail"], fail)
+
+    @staticmethod
+    def _add(history, counters):
+
+        # Soma contadores (ID da regra -> sucesso/falha) ao histórico.
+
+        for rid, data in counters.items():
+            entry = history.setdefault(rid, {"success": 0, "fail": 0})
+            entry["success"] = entry.get("success", 0) + data["success"]
+            entry["fail"] = entry.get("fail", 0) + data["fail"]
+
+    @classmethod
+    def _totals(cls, state):
+
+        # Histórico total do estado: a base mais os contadores de todos os processos.
+
+        history = copy.deepcopy(state["base"])
+        for counters in state["writers"].values():
+            cls._add(history, counters)
+        return history
+
+    def _replay_log(self, state, digest):
+
+        # Reaplica ao estado os eventos do log que pertencem ao estado carregado (mesmo hash no cabeçalho): os
+        # contadores de cada processo ficam com o maior valor visto (as linhas podem vir em qualquer ordem).
+        # Linhas no formato antigo (incrementos: regra, sucesso, peso, data) são somadas à base.
+        # Uma linha inválida no meio do log (gravação interrompida de outro processo, já encerrada por quem gravou
+        # depois) é ignorada; uma última linha incompleta é descartada.
+        # No modo somente leitura, o log é apenas lido (nunca reiniciado ou truncado).
+
+        if not os.path.exists(self.log_file):
+            if not self.read_only:
+                self._reset_log(digest)
+            return
+
+        with open(self.log_file, 'rb') as f:
+            content = f.read()
+        lines = content.split(b"\n")
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get("snapshot") != digest:
+            if not self.read_only:
+                self._reset_log(digest)  # Log de outro snapshot (já compactado ou arquivo editado): descarta
+            return
+
+        good = len(lines[0]) + 1  # Bytes do log até o último evento válido
+        last = len(lines) - 1
+        for i, line in enumerate(lines[1:], 1):
+            if line:
+                try:
+                    event = json.loads(line)
+                    if len(event) == 4:
+                        rule_id, success, weight, _ = event
+                        apply_feedback(state["base"], rule_id, success, weight)
+                    else:
+                        rid, writer, success, fail, _ = event
+                        self._merge(state["writers"].setdefault(writer, {}), rid, success, fail)
+                except (ValueError, TypeError):
+                    if i == last:
+                        break  # Última linha, sem quebra de linha: gravação interrompida
+                    good += len(line) + 1
+                    continue
+                self.log_events += 1
+            good += len(line) + 1
+        good = min(good, len(content))  # A última linha pode não terminar com quebra de linha
+
+        if good < len(content) and not self.read_only:
+            with open(self.log_file, 'r+b') as f:
+                f.truncate(good)  # Remove uma linha incompleta, para não corromper os próximos eventos
+
+    def _reset_log(self, digest):
+
+        # Recria o log de feedback vazio, com o cabeçalho apontando para o snapshot atual do histórico.
+
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        header = json.dumps({"snapshot": digest}) + "\n"
+        self._replace(self.log_file, header.encode('utf-8'))
+        self.log_events = 0
+        self._unsynced = False
+
+    def _replace(self, path, data):
+
+        # Grava o arquivo de forma atômica (arquivo temporário + os.replace), com fsync conforme a política.
+
+        with atomic_write(path) as f:
+            f.write(data)
+            if self.fsync is not None and self.fsync != "never":
+                f.flush()
+                os.fsync(f.fileno())  # O conteúdo chega ao disco antes de substituir o arquivo
+
+    @staticmethod
+    def _digest(data):
+        return hashlib.sha256(data).hexdigest()
 
     def _create_default_kb(self):
-        # Cria a base de conhecimento padrão caso os arquivos não existam
+        # Cria a base de conhecimento padrão caso os arquivos não existam (no modo somente leitura, não grava)
+        # :return: A base padrão.
         default_kb = {
             "symptoms": [
                 {"id": 1,  "name": "computador não liga"},
@@ -119,78 +699,1631 @@ class Persistence:
             ]
         }
 
-        # Salva a base de conhecimento padrão no arquivo
-        with open(self.kb_file, 'w') as f:
-            json.dump(default_kb, f, indent=2, ensure_ascii=False)
-        print("Base de conhecimento padrão criada.")
+        # Salva a base de conhecimento padrão no arquivo (ou no banco, no backend "sqlite")
+        if self.store is not None:
+            self.store.import_all(default_kb, {})  # No modo somente leitura, o banco está em memória
+        elif not self.read_only:
+            with open(self.kb_file, 'w') as f:
+                json.dump(default_kb, f, indent=2, ensure_ascii=False)
+        if not self.read_only:
+            print("Base de conhecimento padrão criada.", file=sys.stderr)  # stderr: não mistura com a saída do modo em lote
+        return default_kb
+
+# Armazenamento em SQLite
+# Backend alternativo da persistência: base de conhecimento e histórico em um único banco SQLite, em tabelas
+# indexadas. O feedback vira um UPSERT por regra e uma nova regra, uma pequena transação, sem regravar arquivos
+# inteiros. A coluna "pos" guarda a ordem original dos registros (a ordem das regras desempata o ranking) e os
+# campos extras de cada registro (ex.: "asserts", "salience") ficam em JSON na coluna "extra".
+
+class SQLiteStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS symptoms (pos INTEGER PRIMARY KEY, id, name, extra TEXT);
+        CREATE TABLE IF NOT EXISTS solutions (pos INTEGER PRIMARY KEY, id, name, extra TEXT);
+        CREATE TABLE IF NOT EXISTS rules (pos INTEGER PRIMARY KEY, id, solution, extra TEXT);
+        CREATE TABLE IF NOT EXISTS rule_symptoms (rule_pos INTEGER, idx INTEGER, symptom_id,
+                                                  PRIMARY KEY (rule_pos, idx)) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS history (rule_id TEXT PRIMARY KEY, success NUMERIC, fail NUMERIC);
+        CREATE INDEX IF NOT EXISTS symptoms_id ON symptoms (id);
+        CREATE INDEX IF NOT EXISTS solutions_id ON solutions (id);
+        CREATE INDEX IF NOT EXISTS rules_id ON rules (id);
+        CREATE INDEX IF NOT EXISTS rule_symptoms_symptom ON rule_symptoms (symptom_id);
+    """  # Colunas de ID sem tipo: preservam inteiros e textos (fatos derivados) como foram gravados
+
+    def __init__(self, db_file='kb.db', read_only=False):
+
+        # :param read_only: Se True, abre o banco somente para leitura (um banco inexistente vira um banco vazio
+        #                   em memória, sem criar o arquivo). Em modo WAL, o próprio SQLite ainda pode criar os
+        #                   arquivos auxiliares -wal/-shm (usados só para coordenar com outros processos).
+
+        self.db_file = db_file
+        # As escritas são serializadas por quem chama (ex.: trava de escrita do motor no servidor HTTP)
+        if read_only and os.path.exists(db_file):
+            uri = pathlib.Path(db_file).resolve().as_uri() + "?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(":memory:" if read_only else db_file, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")  # Escritas pequenas sem bloquear leitores
+            self.conn.executescript(self.SCHEMA)
+        self._counts = self._stored_counts()  # Registros já gravados por tabela da base
+
+    def _stored_counts(self):
+        return {table: self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("symptoms", "solutions", "rules")}
+
+    def is_empty(self):
+        return not any(self._counts.values())
+
+    def set_synchronous(self, mode):
+
+        # Define a política de sincronização do SQLite com o disco ("FULL", "NORMAL" ou "OFF").
+
+        self.conn.execute(f"PRAGMA synchronous={mode}")
+
+    def load_kb(self):
+
+        # Lê a base de conhecimento do banco, na ordem original dos registros (mesmo formato do kb.json).
+
+        kb = {}
+        for table in ("symptoms", "solutions"):
+            kb[table] = [self._record({"id": rid, "name": name}, extra)
+                         for rid, name, extra in self.conn.execute(f"SELECT id, name, extra FROM {table} ORDER BY pos")]
+
+        symptoms = {}  # Posição da regra -> sintomas, na ordem original
+        for rule_pos, symptom_id in self.conn.execute("SELECT rule_pos, symptom_id FROM rule_symptoms ORDER BY rule_pos, idx"):
+            symptoms.setdefault(rule_pos, []).append(symptom_id)
+        kb["rules"] = []
+        for pos, rid, solution, extra in self.conn.execute("SELECT pos, id, solution, extra FROM rules ORDER BY pos"):
+            rule = {"id": rid, "symptoms": symptoms.get(pos, [])}
+            if solution is not None:
+                rule["solution"] = solution  # Regras só de encadeamento não têm solução
+            kb["rules"].append(self._record(rule, extra))
+        return kb
+
+    def load_history(self):
+
+        # Lê o histórico do banco (mesmo formato do history.json).
+
+        return {rid: {"success": success, "fail": fail}
+                for rid, success, fail in self.conn.execute("SELECT rule_id, success, fail FROM history")}
+
+    def sync_kb(self, kb):
+
+        # Grava os registros acrescentados à base desde a última gravação, numa única transação.
+        # A base só cresce pela aplicação (novos sintomas, soluções e regras); edições em registros existentes
+        # são gravadas com replace_kb.
+
+        with self.conn:
+            self._insert_kb(kb, self._counts)
+        self._counts = {table: len(kb[table]) for table in ("symptoms", "solutions", "rules")}
+
+    def replace_kb(self, kb):
+
+        # Substitui toda a base gravada pela base informada, numa única transação (o histórico não muda).
+
+        with self.conn:
+            for table in ("symptoms", "solutions", "rules", "rule_symptoms"):
+                self.conn.execute(f"DELETE FROM {table}")
+            self._insert_kb(kb, {"symptoms": 0, "solutions": 0, "rules": 0})
+        self._counts = {table: len(kb[table]) for table in ("symptoms", "solutions", "rules")}
+
+    def _insert_kb(self, kb, start):
+
+        # Insere os registros da base a partir das posições `start` (por tabela). Deve ser chamado numa transação.
+
+        for table in ("symptoms", "solutions"):
+            self.conn.executemany(
+                f"INSERT INTO {table} (pos, id, name, extra) VALUES (?, ?, ?, ?)",
+                ((pos, rec["id"], rec.get("name"), self._extra(rec, ("id", "name")))
+                 for pos, rec in enumerate(kb[table][start[table]:], start[table])))
+        for pos, rule in enumerate(kb["rules"][start["rules"]:], start["rules"]):
+            self.conn.execute("INSERT INTO rules (pos, id, solution, extra) VALUES (?, ?, ?, ?)",
+                              (pos, rule["id"], rule.get("solution"), self._extra(rule, ("id", "symptoms", "solution"))))
+            self.conn.executemany("INSERT INTO rule_symptoms (rule_pos, idx, symptom_id) VALUES (?, ?, ?)",
+                                  ((pos, idx, sid) for idx, sid in enumerate(rule.get("symptoms", []))))
+
+    def add_feedback(self, updates):
+
+        # Aplica feedbacks ao histórico gravado (mesma regra de apply_feedback), numa única transação.
+        # :param updates: Lista de tuplas (rule_id, success, penalty_factor).
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO history (rule_id, success, fail) VALUES (?, ?, ?) "
+                "ON CONFLICT (rule_id) DO UPDATE SET success = success + excluded.success, fail = fail + excluded.fail",
+                ((str(rule_id), 1, 0) if success else (str(rule_id), 0, penalty_factor)
+                 for rule_id, success, penalty_factor in updates))
+
+    def save_history(self, history):
+
+        # Substitui o histórico gravado pelo histórico informado.
+
+        with self.conn:
+            self.conn.execute("DELETE FROM history")
+            self.conn.executemany("INSERT INTO history (rule_id, success, fail) VALUES (?, ?, ?)",
+                                  ((rid, data.get("success", 0), data.get("fail", 0)) for rid, data in history.items()))
+
+    def import_all(self, kb, history):
+
+        # Substitui todo o conteúdo do banco pela base e pelo histórico informados (migração a partir do JSON).
+
+        self.replace_kb(kb)
+        self.save_history(history)
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def _extra(record, known):
+        extra = {key: value for key, value in record.items() if key not in known}
+        return json.dumps(extra, ensure_ascii=False) if extra else None
+
+    @staticmethod
+    def _record(record, extra):
+        if extra:
+            record.update(json.loads(extra))
+        return record
+
+# Tabela de regras compiladas
+# Pré-processa as regras uma única vez: cada regra vira uma máscara de bits sobre índices densos de sintomas,
+# acompanhada do seu tamanho (popcount). A interseção com a consulta passa a ser um AND entre inteiros.
+
+class CompiledRules:
+    def __init__(self, rules):
+        self.rule_ids = []  # ID de cada regra, por posição
+        self.solution_ids = []  # ID da solução de cada regra, por posição
+        self.masks = []  # Máscara de bits dos sintomas de cada regra
+        self.sizes = []  # Quantidade de sintomas distintos de cada regra (popcount da máscara)
+        self.symptom_bits = {}  # ID do sintoma -> índice denso do bit correspondente
+        self.postings = {}  # Índice invertido: ID do sintoma -> posições das regras que o contêm
+        self.rule_positions = {}  # ID da regra (como string, igual ao histórico) -> posições na tabela
+        self._owned = set()  # Sintomas cujas listas de postings pertencem a esta tabela (não compartilhadas com cópias)
+        self.packed = None  # Base compilada em arquivo (CompiledKB) que a tabela reflete sem alterações
+        for rule in rules:
+            self.add(rule)
+
+    @classmethod
+    def from_packed(cls, packed):
+
+        # Monta a tabela a partir de uma base compilada em arquivo (CompiledKB), sem percorrer as regras:
+        # IDs, tamanhos e máscaras são lidos do arquivo mapeado sob demanda e as listas de postings são
+        # fatias do próprio arquivo.
+
+        table = cls(())
+        n_rules = len(packed.table_rule)
+        table.rule_ids = PackedColumn(n_rules, lambda pos: packed.value(packed.rule_id[packed.table_rule[pos]]))
+        table.solution_ids = PackedColumn(n_rules, lambda pos: packed.value(packed.rule_solution[packed.table_rule[pos]]))
+        table.sizes = PackedColumn(n_rules, packed.table_size.__getitem__)
+        table.masks = PackedColumn(n_rules, packed.mask, cache=True)
+        for bit, value in enumerate(packed.bit_value):
+            sid = packed.value(value)
+            table.symptom_bits[sid] = bit
+            table.postings[sid] = packed.post_pos[packed.post_ptr[bit]:packed.post_ptr[bit + 1]]
+        keys = {}  # Índice do valor -> ID da regra como string (chave do histórico)
+        for pos, vid in enumerate([packed.rule_id[index] for index in packed.table_rule]):
+            key = keys.get(vid)
+            if key is None:
+                key = keys[vid] = str(packed.value(vid))
+            table.rule_positions.setdefault(key, []).append(pos)
+        table.packed = packed
+        return table
+
+    def copy(self):
+
+        # Retorna uma cópia da tabela que pode receber novas regras sem alterar esta (cópia na escrita).
+        # As listas de postings continuam compartilhadas até serem alteradas pela cópia.
+
+        table = CompiledRules(())
+        table.rule_ids = self.rule_ids.copy()
+        table.solution_ids = self.solution_ids.copy()
+        table.masks = self.masks.copy()
+        table.sizes = self.sizes.copy()
+        table.symptom_bits = dict(self.symptom_bits)
+        table.postings = dict(self.postings)
+        table.rule_positions = dict(self.rule_positions)
+        table.packed = self.packed
+        return table
+
+    def add(self, rule):
+
+        # Compila uma regra e a acrescenta ao final da tabela.
+        # Regras apenas de encadeamento (sem "solution") não são pontuadas e ficam fora da tabela.
+        # :param rule: Dicionário com "id", "symptoms" e "solution".
+        # :return: Posição da regra na tabela (na mesma ordem de kb["rules"]), ou None se a regra não tiver solução.
+
+        if "solution" not in rule:
+            return None
+        self.packed = None  # A tabela passa a ter regras que não estão no arquivo compilado
+        pos = len(self.rule_ids)
+        mask = 0
+        for sid in set(rule.get("symptoms", [])):  # Conjunto para não repetir a regra na mesma lista
+            bit = self.symptom_bits.setdefault(sid, len(self.symptom_bits))  # Novos sintomas recebem o próximo bit livre
+            mask |= 1 << bit
+            if sid not in self._owned:
+                self.postings[sid] = list(self.postings.get(sid, ()))  # Lista própria antes de alterar
+                self._owned.add(sid)
+            self.postings[sid].append(pos)
+
+        self.rule_ids.append(rule["id"])
+        key = str(rule["id"])
+        self.rule_positions[key] = self.rule_positions.get(key, []) + [pos]  # Nova lista: cópias não são afetadas
+        self.solution_ids.append(rule["solution"])
+        self.masks.append(mask)
+        self.sizes.append(mask.bit_count())
+        return pos
+
+    def query_mask(self, user_set):
+
+        # Converte os sintomas do usuário em uma única máscara de bits.
+        # Sintomas que não aparecem em nenhuma regra não possuem bit e são ignorados aqui.
+
+        mask = 0
+        for sid in user_set:
+            bit = self.symptom_bits.get(sid)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    def candidates(self, user_set):
+
+        # Retorna, na ordem da base de conhecimento, as posições das regras que compartilham
+        # ao menos um sintoma com o usuário. As demais teriam aderência zero.
+
+        found = set()
+        for sid in user_set:
+            found.update(self.postings.get(sid, ()))
+        return sorted(found)
+
+# Coluna de uma tabela lida de arquivo
+# Sequência cujos primeiros valores vêm de uma função sobre o arquivo mapeado (calculados sob demanda e,
+# opcionalmente, guardados em cache) e os demais de uma lista comum (valores acrescentados depois).
+
+class PackedColumn:
+    def __init__(self, size, load, cache=False):
+        self._size = size  # Quantidade de valores lidos do arquivo
+        self._load = load  # Função posição -> valor
+        self._cache = {} if cache else None  # Valores já calculados (compartilhado entre cópias; é determinístico)
+        self._tail = []  # Valores acrescentados depois da leitura
+
+    def __len__(self):
+        return self._size + len(self._tail)
+
+    def __getitem__(self, pos):
+        if pos >= self._size:
+            return self._tail[pos - self._size]
+        if self._cache is None:
+            return self._load(pos)
+        value = self._cache.get(pos)
+        if value is None:
+            value = self._cache[pos] = self._load(pos)
+        return value
+
+    def __iter__(self):
+        for pos in range(self._size):
+            yield self[pos]
+        yield from self._tail
+
+    def append(self, value):
+        self._tail.append(value)
+
+    def copy(self):
+        column = copy.copy(self)
+        column._tail = list(self._tail)
+        return column
+
+# Leitura incremental do kb.json
+# Percorre os vetores "symptoms", "solutions" e "rules" do arquivo registro a registro, lendo blocos de bytes
+# e interpretando cada registro com JSONDecoder.raw_decode, sem montar o documento inteiro em memória (um
+# json.load em uma base de centenas de MB dobra o pico de memória). Também calcula o hash SHA-256 do arquivo
+# durante a leitura. Os demais campos do objeto principal são interpretados e descartados.
+
+class KBRecordStream:
+    PARTS = ("symptoms", "solutions", "rules")
+    WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self, path, chunk_size=1 << 20):
+
+        # :param path: Arquivo JSON da base de conhecimento.
+        # :param chunk_size: Tamanho (em bytes) de cada bloco lido do arquivo.
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.digest = None  # Hash SHA-256 do arquivo, disponível depois de percorrer todos os registros
+        self._decoder = json.JSONDecoder()
+
+    def __iter__(self):
+
+        # Gera tuplas (parte, registro), na ordem em que aparecem no arquivo.
+
+        self._hash = hashlib.sha256()
+        self._text = codecs.getincrementaldecoder("utf-8-sig")()
+        self._buffer = ""  # Trecho já lido e ainda não interpretado
+        self._pos = 0
+        with open(self.path, 'rb') as self._file:
+            self._expect("{")
+            if self._peek() == "}":
+                self._pos += 1
+            else:
+                while True:
+                    key = self._decode()
+                    if not isinstance(key, str):
+                        self._error("Esperado nome de campo")
+                    self._expect(":")
+                    if key in self.PARTS and self._peek() == "[":
+                        self._pos += 1
+                        if self._peek() == "]":
+                            self._pos += 1
+                        else:
+                            while True:
+                                yield key, self._decode()  # Um registro por vez
+                                if self._expect(",]") == "]":
+                                    break
+                    else:
+                        self._decode()  # Outros campos: interpretados e descartados
+                    if self._expect(",}") == "}":
+                        break
+            if self._peek():
+                self._error("Conteúdo extra depois do objeto principal")
+        self.digest = self._hash.digest()
+
+    def _read(self):
+
+        # Acrescenta o próximo bloco do arquivo ao trecho pendente, descartando o que já foi interpretado.
+        # :return: False no fim do arquivo.
+
+        data = self._file.read(self.chunk_size)
+        self._hash.update(data)
+        text = self._text.decode(data, final=not data)
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return bool(data)
+
+    def _peek(self):
+
+        # Próximo caractere depois dos espaços em branco ("" no fim do arquivo), sem consumi-lo.
+
+        while True:
+            self._pos = self.WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer) or not self._read():
+                return self._buffer[self._pos:self._pos + 1]
+
+    def _expect(self, chars):
+        char = self._peek()
+        if not char or char not in chars:
+            self._error(f"Esperado um de {chars!r}")
+        self._pos += 1
+        return char
+
+    def _decode(self):
+
+        # Interpreta o próximo valor JSON, lendo mais blocos enquanto ele estiver incompleto.
+
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._read():
+                    continue
+                raise
+            # Um valor que termina no fim do trecho lido (ex.: um número) pode continuar no próximo bloco
+            if end < len(self._buffer) or not self._read():
+                self._pos = end
+                return value
+
+    def _error(self, message):
+        raise json.JSONDecodeError(message, self._buffer, self._pos)
+
+# Base compilada em arquivo binário
+# Versão binária da base (ex.: kb.bin ao lado do kb.json) que pode ser aberta com mmap, sem interpretar o JSON
+# nem recompilar as regras: vários processos compartilham as mesmas páginas e a abertura é quase O(1).
+# Contém uma tabela de textos e uma de valores (IDs inteiros ou textos), os registros de sintomas, soluções e
+# regras (sintomas das regras em CSR), e a tabela de regras compiladas: tamanhos, bits de cada regra (CSR),
+# o sintoma de cada bit e o índice invertido bit -> posições (CSC). O cabeçalho guarda o hash SHA-256 do JSON
+# de origem (e o tamanho e a data de modificação, para não recalcular o hash a cada abertura); se o JSON mudar,
+# o arquivo é gerado de novo, compilando os registros à medida que são lidos (veja CompiledKBWriter).
+
+class CompiledKB:
+    MAGIC = b"KBCOMP1\0"
+    HEADER = struct.Struct("<8s1s7x32sqq")  # Assinatura, ordem dos bytes, hash da origem, tamanho, data (ns)
+    SECTIONS = (
+        ("str_ptr", "q"), ("str_data", "B"),  # Tabela de textos (UTF-8): início de cada texto
+        ("val_kind", "b"), ("val_data", "q"),  # Valores: 0 = inteiro, 1 = texto, 2 = outro (texto JSON)
+        ("sym_id", "i"), ("sym_name", "i"), ("sym_extra", "i"),  # Sintomas: valor, texto, texto JSON (-1 = ausente)
+        ("sol_id", "i"), ("sol_name", "i"), ("sol_extra", "i"),  # Soluções
+        ("rule_id", "i"), ("rule_solution", "i"), ("rule_extra", "i"),  # Regras (solução -1 = só encadeamento)
+        ("rule_ptr", "q"), ("rule_syms", "i"),  # Sintomas de cada regra (CSR, na ordem original)
+        ("chain_rules", "i"),  # Regras com "asserts" (entram na rede Rete)
+        ("table_rule", "i"), ("table_size", "i"),  # Tabela compilada: regra de origem e tamanho de cada posição
+        ("table_ptr", "q"), ("table_bits", "i"),  # Bits de cada posição (CSR)
+        ("bit_value", "i"), ("post_ptr", "q"), ("post_pos", "q")  # Sintoma de cada bit e índice invertido (CSC)
+    )
+    SECTION = struct.Struct("<qq")  # Início (bytes) e quantidade de itens de cada seção
+
+    def __init__(self, buffer, source=None):
+
+        # :param buffer: Conteúdo do arquivo (mmap ou bytes).
+        # :param source: Arquivo JSON de origem, usado por load_kb().
+
+        self._buffer = buffer
+        self.source = source
+        self._kb = None  # Base em dicionários, carregada do JSON só quando necessária
+        self._lock = threading.Lock()
+        view = memoryview(buffer)
+        _, _, self.digest, self.source_size, self.source_mtime = self.HEADER.unpack_from(view)
+        for index, (name, typecode) in enumerate(self.SECTIONS):
+            offset, count = self.SECTION.unpack_from(view, self.HEADER.size + index * self.SECTION.size)
+            size = count * array(typecode).itemsize
+            setattr(self, name, view[offset:offset + size].cast(typecode))
+
+    @classmethod
+    def open(cls, kb_file, path=None, write=True):
+
+        # Abre a base compilada de `kb_file`, gerando-a de novo se não existir ou se o JSON tiver mudado.
+        # :param path: Arquivo binário (padrão: o nome da base com extensão .bin, ex.: kb.bin).
+        # :param write: Se False, nunca grava o arquivo binário (uma base desatualizada é compilada em memória).
+
+        path = path or os.path.splitext(kb_file)[0] + ".bin"
+        stat = os.stat(kb_file)
+        packed = cls._map(path, kb_file)
+        if packed is not None and (packed.source_size, packed.source_mtime) == (stat.st_size, stat.st_mtime_ns):
+            return packed  # Mesmo tamanho e data de modificação: não precisa recalcular o hash
+
+        if packed is not None:
+            digest = cls._hash_file(kb_file)
+            if packed.digest == digest:
+                # Conteúdo igual (ex.: arquivo copiado): só atualiza tamanho e data no cabeçalho
+                try:
+                    if write:
+                        with open(path, 'r+b') as f:
+                            f.write(cls.HEADER.pack(cls.MAGIC, cls._order(), digest, stat.st_size, stat.st_mtime_ns))
+                except OSError:
+                    pass
+                return packed
+
+        # Compila os registros à medida que são lidos, sem montar a base inteira em dicionários
+        records = KBRecordStream(kb_file)
+        writer = CompiledKBWriter()
+        for part, record in records:
+            writer.add(part, record)
+        packed = None
+        if write:
+            try:
+                with atomic_write(path) as f:  # Outros processos só mapeiam o arquivo já completo
+                    writer.write(f, records.digest, stat.st_size, stat.st_mtime_ns)
+                packed = cls._map(path, kb_file)
+            except OSError:
+                pass
+        if packed is None:
+            out = io.BytesIO()  # Sem gravação (ou sem permissão de escrita): usa a versão em memória
+            writer.write(out, records.digest, stat.st_size, stat.st_mtime_ns)
+            packed = cls(out.getvalue(), kb_file)
+        return packed
+
+    @staticmethod
+    def _hash_file(path, chunk_size=1 << 20):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(chunk_size), b""):
+                digest.update(data)
+        return digest.digest()
+
+    @classmethod
+    def _map(cls, path, source):
+
+        # Mapeia o arquivo binário em memória, ou retorna None se ele não existir ou for de outro formato.
+
+        try:
+            with open(path, 'rb') as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if buffer[:8] != cls.MAGIC or buffer[8:9] != cls._order():
+            buffer.close()
+            return None
+        return cls(buffer, source)
+
+    @staticmethod
+    def _order():
+        return b"l" if sys.byteorder == "little" else b"b"  # As seções usam a ordem de bytes da máquina
+
+    @classmethod
+    def build(cls, kb, digest=b"", source_size=0, source_mtime=0):
+
+        # Gera o conteúdo do arquivo binário a partir da base em dicionários.
+
+        writer = CompiledKBWriter()
+        for part in KBRecordStream.PARTS:
+            for record in kb[part]:
+                writer.add(part, record)
+        out = io.BytesIO()
+        writer.write(out, digest, source_size, source_mtime)
+        return out.getvalue()
+
+    def string(self, index):
+        return bytes(self.str_data[self.str_ptr[index]:self.str_ptr[index + 1]]).decode("utf-8")
+
+    def value(self, index):
+        kind = self.val_kind[index]
+        if kind == 0:
+            return self.val_data[index]
+        if kind == 1:
+            return self.string(self.val_data[index])
+        return json.loads(self.string(self.val_data[index]))
+
+    def mask(self, pos):
+
+        # Máscara de bits da regra na posição `pos` da tabela compilada.
+
+        mask = 0
+        for bit in self.table_bits[self.table_ptr[pos]:self.table_ptr[pos + 1]]:
+            mask |= 1 << bit
+        return mask
+
+    def records(self, prefix):
+
+        # Registros de sintomas ("sym") ou soluções ("sol"), como dicionários.
+
+        ids, names, extras = (getattr(self, prefix + suffix) for suffix in ("_id", "_name", "_extra"))
+        records = []
+        for vid, name, extra in zip(ids, names, extras):
+            record = {"id": self.value(vid)}
+            if name >= 0:
+                record["name"] = self.string(name)
+            if extra >= 0:
+                record.update(json.loads(self.string(extra)))
+            records.append(record)
+        return records
+
+    def rule(self, index):
+
+        # Regra na posição `index` de kb["rules"], como dicionário.
+
+        rule = {"id": self.value(self.rule_id[index]),
+                "symptoms": [self.value(v) for v in self.rule_syms[self.rule_ptr[index]:self.rule_ptr[index + 1]]]}
+        if self.rule_solution[index] >= 0:
+            rule["solution"] = self.value(self.rule_solution[index])
+        if self.rule_extra[index] >= 0:
+            rule.update(json.loads(self.string(self.rule_extra[index])))
+        return rule
+
+    def load_kb(self):
+
+        # Retorna a base em dicionários (lida do JSON de origem na primeira chamada; sempre o mesmo objeto).
+
+        with self._lock:
+            if self._kb is None:
+                with open(self.source, 'r') as f:
+                    self._kb = json.load(f)
+            return self._kb
+
+# Geração da base compilada
+# Monta as seções de CompiledKB registro a registro (na ordem do kb.json), de modo que a base possa ser
+# compilada durante a leitura incremental do arquivo (KBRecordStream). Só as seções já compactas (arrays) e os
+# dicionários de deduplicação de textos e valores ficam em memória.
+
+class CompiledKBWriter:
+    def __init__(self):
+        self.sections = {name: array(typecode) for name, typecode in CompiledKB.SECTIONS}
+        self._strings = {}  # Texto -> índice na tabela de textos
+        self._ints = {}  # Inteiro -> índice na tabela de valores
+        self._values = {}  # (tipo, texto) -> índice na tabela de valores (textos e outros valores)
+        self._symptom_bits = {}  # Mesma atribuição de bits de CompiledRules
+        self._postings = []  # Bit -> posições da tabela compilada
+        self._rules = 0  # Regras já lidas
+        self.sections["str_ptr"].append(0)
+        self.sections["rule_ptr"].append(0)
+        self.sections["table_ptr"].append(0)
+
+    def add(self, part, record):
+
+        # Acrescenta um registro de `part` ("symptoms", "solutions" ou "rules").
+
+        sections = self.sections
+        if part != "rules":
+            prefix = "sym" if part == "symptoms" else "sol"
+            sections[prefix + "_id"].append(self._value(record["id"]))
+            sections[prefix + "_name"].append(self._text(record.get("name")))
+            sections[prefix + "_extra"].append(self._extra(record, ("id", "name")))
+            return
+
+        index = self._rules
+        self._rules += 1
+        sections["rule_id"].append(self._value(record["id"]))
+        sections["rule_solution"].append(self._value(record["solution"]) if "solution" in record else -1)
+        sections["rule_extra"].append(self._extra(record, ("id", "symptoms", "solution")))
+        sections["rule_syms"].extend(self._value(sid) for sid in record.get("symptoms", []))
+        sections["rule_ptr"].append(len(sections["rule_syms"]))
+        if record.get("asserts"):
+            sections["chain_rules"].append(index)
+        if "solution" not in record:
+            return
+        pos = len(sections["table_rule"])
+        bits = []
+        for sid in set(record.get("symptoms", [])):
+            bit = self._symptom_bits.get(sid)
+            if bit is None:
+                bit = self._symptom_bits[sid] = len(self._symptom_bits)
+                sections["bit_value"].append(self._value(sid))
+                self._postings.append(array("q"))
+            self._postings[bit].append(pos)
+            bits.append(bit)
+        sections["table_rule"].append(index)
+        sections["table_size"].append(len(bits))
+        sections["table_bits"].extend(bits)
+        sections["table_ptr"].append(len(sections["table_bits"]))
+
+    def write(self, f, digest=b"", source_size=0, source_mtime=0):
+
+        # Grava o arquivo binário em `f`: cabeçalho, tabela de seções e seções alinhadas em 8 bytes.
+        # O índice invertido é montado aqui, quando todas as regras já foram lidas.
+
+        sections = self.sections
+        sections["post_ptr"] = array("q", [0])
+        sections["post_pos"] = array("q")
+        for rows in self._postings:
+            sections["post_pos"].extend(rows)
+            sections["post_ptr"].append(len(sections["post_pos"]))
+
+        offset = CompiledKB.HEADER.size + len(CompiledKB.SECTIONS) * CompiledKB.SECTION.size
+        table = []
+        for name, _ in CompiledKB.SECTIONS:
+            offset += -offset % 8
+            table.append(CompiledKB.SECTION.pack(offset, len(sections[name])))
+            offset += len(sections[name]) * sections[name].itemsize
+        f.write(CompiledKB.HEADER.pack(CompiledKB.MAGIC, CompiledKB._order(), digest, source_size, source_mtime))
+        f.write(b"".join(table))
+        offset = CompiledKB.HEADER.size + len(CompiledKB.SECTIONS) * CompiledKB.SECTION.size
+        for name, _ in CompiledKB.SECTIONS:
+            f.write(b"\0" * (-offset % 8))
+            offset += -offset % 8
+            sections[name].tofile(f)
+            offset += len(sections[name]) * sections[name].itemsize
+
+    def _text(self, value):
+        if value is None:
+            return -1
+        index = self._strings.get(value)
+        if index is None:
+            index = self._strings[value] = len(self._strings)
+            self.sections["str_data"].frombytes(value.encode("utf-8"))
+            self.sections["str_ptr"].append(len(self.sections["str_data"]))
+        return index
+
+    def _value(self, v):
+        if isinstance(v, int) and not isinstance(v, bool):
+            index = self._ints.get(v)
+            if index is None:
+                index = self._ints[v] = self._new_value(0, v)
+            return index
+        key = (1, self._text(v)) if isinstance(v, str) else (2, self._text(json.dumps(v)))
+        index = self._values.get(key)
+        if index is None:
+            index = self._values[key] = self._new_value(*key)
+        return index
+
+    def _new_value(self, kind, data):
+        self.sections["val_kind"].append(kind)
+        self.sections["val_data"].append(data)
+        return len(self.sections["val_kind"]) - 1
+
+    def _extra(self, record, known):
+        rest = {k: v for k, v in record.items() if k not in known}
+        return self._text(json.dumps(rest, ensure_ascii=False)) if rest else -1
+
+# Backend vetorizado (NumPy)
+# Representa as regras como uma matriz de incidência esparsa (regras x sintomas), guardada por coluna:
+# para cada sintoma, o vetor com as posições das regras que o contêm. Tamanhos das regras e precisões
+# históricas suavizadas ficam em vetores densos, e o score de todas as regras sai de poucas operações de array.
+
+class NumpyRules:
+    def __init__(self, table, precisions):
+
+        # :param table: Tabela de regras compiladas (CompiledRules).
+        # :param precisions: Precisão histórica suavizada de cada regra, por posição.
+
+        self.n_rules = len(table.rule_ids)
+        self.symptom_bits = dict(table.symptom_bits)  # Cópia: a matriz não acompanha regras adicionadas depois
+
+        # Matriz de incidência no formato de colunas comprimidas (CSC)
+        if table.packed is not None:
+            # Tabela lida de uma base compilada: as colunas já estão no arquivo mapeado (sem cópia)
+            self.col_ptr = np.frombuffer(table.packed.post_ptr, dtype=np.int64)
+            self.col_rows = np.frombuffer(table.packed.post_pos, dtype=np.int64)
+        else:
+            columns = [[] for _ in range(len(self.symptom_bits))]
+            for sid, bit in self.symptom_bits.items():
+                columns[bit] = table.postings[sid]
+            self.col_ptr = np.zeros(len(columns) + 1, dtype=np.int64)
+            np.cumsum([len(c) for c in columns], out=self.col_ptr[1:])
+            self.col_rows = np.fromiter((pos for c in columns for pos in c), dtype=np.int64, count=int(self.col_ptr[-1]))
+
+        self.sizes = np.array(table.sizes, dtype=np.float64)  # Quantidade de sintomas de cada regra
+        self.precisions = np.array(precisions, dtype=np.float64)  # Precisão histórica
+
+    def with_precisions(self, updates):
+
+        # Retorna uma cópia que compartilha a matriz, mas com outro vetor de precisões.
+        # :param updates: Dicionário posição -> nova precisão.
+
+        vector = copy.copy(self)
+        vector.precisions = self.precisions.copy()
+        for pos, precision in updates.items():
+            vector.precisions[pos] = precision
+        return vector
+
+    def score(self, user_set, derived=()):
+
+        # Calcula interseção, precisão da regra, recall do usuário, F1 e score final de uma consulta.
+        # :param user_set: Conjunto de IDs dos sintomas do usuário.
+        # :param derived: Fatos derivados pelo encadeamento (fora de `user_set`).
+        # :return: Tupla de arrays (posições, precision_rule, recall_user, match, score, precisão histórica),
+        #          apenas das regras com interseção, em ordem de posição.
+
+        return self.score_batch([user_set], [derived])[1:]
+
+    def score_batch(self, user_sets, derived_sets=None):
+
+        # Pontua várias consultas de uma vez, como o produto esparso entre a matriz de consultas
+        # (consultas x sintomas) e a matriz de regras transposta.
+        # :param user_sets: Lista de conjuntos de IDs de sintomas.
+        # :param derived_sets: Fatos derivados de cada consulta (fora do conjunto de sintomas), ou None.
+        #                      O recall de cada regra conta só os fatos derivados que ela testa (como em _scorer).
+        # :return: Tupla de arrays (consulta, posição, precision_rule, recall_user, match, score, precisão histórica),
+        #          apenas dos pares com interseção, ordenados por consulta e posição.
+
+        # Entradas não nulas da matriz de consultas: (consulta, coluna do sintoma, fato derivado?)
+        query_idx, bits, from_derived = [], [], []
+        for qi, user_set in enumerate(user_sets):
+            for facts, flag in ((user_set, False), (derived_sets[qi] if derived_sets else (), True)):
+                for sid in facts:
+                    bit = self.symptom_bits.get(sid)
+                    if bit is not None:
+                        query_idx.append(qi)
+                        bits.append(bit)
+                        from_derived.append(flag)
+        if not bits:
+            empty = np.zeros(0)
+            no_idx = np.zeros(0, dtype=np.int64)
+            return no_idx, no_idx, empty, empty, empty, empty, empty
+
+        # Expande cada entrada na coluna correspondente da matriz de regras, sem laço em Python
+        bits = np.array(bits, dtype=np.int64)
+        starts = self.col_ptr[bits]
+        lengths = self.col_ptr[bits + 1] - starts
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(int(lengths.sum()))
+        rows = self.col_rows[offsets]
+        queries = np.repeat(np.array(query_idx, dtype=np.int64), lengths)
+
+        # Cada par (consulta, regra) repetido é um sintoma em comum: contar os pares dá a interseção
+        n_user = np.array([len(user_set) for user_set in user_sets], dtype=np.float64)
+        if any(from_derived):
+            keys, inverse, intersection = np.unique(queries * self.n_rules + rows, return_inverse=True,
+                                                    return_counts=True)
+            # Fatos derivados em comum com a regra entram no denominador do recall do par
+            flags = np.repeat(np.array(from_derived, dtype=np.float64), lengths)
+            queries, positions = np.divmod(keys, self.n_rules)
+            denominator = n_user[queries] + np.bincount(inverse.ravel(), weights=flags, minlength=len(keys))
+        else:
+            keys, intersection = np.unique(queries * self.n_rules + rows, return_counts=True)
+            queries, positions = np.divmod(keys, self.n_rules)
+            denominator = n_user[queries]
+
+        # Mesmas operações, na mesma ordem, do caminho em Python puro (resultados idênticos em ponto flutuante)
+        precision_rule = intersection / self.sizes[positions]
+        recall_user = intersection / denominator
+        match = 2 * (precision_rule * recall_user) / (precision_rule + recall_user)
+        hist_precision = self.precisions[positions]
+        score = match * hist_precision
+        return queries, positions, precision_rule, recall_user, match, score, hist_precision
+
+# Cache de consultas
+# Cache LRU de resultados do motor de inferência, indexado pelo conjunto canônico de sintomas.
+# Cada entrada guarda a versão do motor em que foi calculada; entradas de versões antigas nunca são servidas.
+
+class QueryCache:
+    def __init__(self, capacity=128):
+        self.capacity = capacity  # Número máximo de consultas guardadas
+        self._entries = OrderedDict()  # Chave -> (versão, resultado), da menos para a mais recente
+        self.hits = 0  # Consultas respondidas pelo cache
+        self.misses = 0  # Consultas ausentes (ou desatualizadas) no cache
+        self.evictions = 0  # Entradas descartadas por falta de espaço
+        self._lock = threading.Lock()  # O OrderedDict é alterado até nas leituras (ordem de uso)
+
+    def get(self, key, version):
+
+        # Retorna o resultado guardado para a chave, ou None se ausente ou calculado em outra versão.
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                if entry is not None and entry[0] < version:
+                    del self._entries[key]  # Resultado desatualizado: descarta
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)  # Marca como usada mais recentemente
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, result):
+
+        # Guarda um resultado, descartando a entrada usada há mais tempo se o cache estiver cheio.
+
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[0] > version:
+                return  # Outra thread já guardou um resultado mais novo
+            self._entries[key] = (version, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+
+        # Retorna os contadores do cache, para dimensionar sua capacidade.
+
+        return {"size": len(self._entries), "capacity": self.capacity,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+# Rede Rete (encadeamento para frente em múltiplos passos)
+# Regras com o campo "asserts" derivam fatos intermediários (por exemplo, "fonte suspeita"), que por sua vez
+# podem disparar outras regras. As condições das regras são compiladas em uma rede Rete: cada fato tem uma
+# memória alfa, e cada regra vira uma cadeia de nós de junção (nós beta) compartilhados entre regras com o
+# mesmo prefixo de condições. Ao inserir um fato, apenas os nós de junção ligados a ele são reavaliados.
+
+class JoinNode:
+    def __init__(self, node_id, parent, fact):
+        self.id = node_id  # Identificador do nó (usado na memória de trabalho)
+        self.parent = parent  # Nó de junção anterior da cadeia (None = raiz, sempre satisfeita)
+        self.fact = fact  # Fato testado por este nó
+        self.children = []  # Nós de junção seguintes
+        self.productions = []  # Regras cujas condições terminam neste nó
+
+# Agenda: ativações prontas para disparar, em uma fila de prioridade ordenada pela estratégia de resolução
+# de conflitos. Cada estratégia recebe a regra e o número sequencial da ativação e retorna a chave de ordenação
+# (menor dispara primeiro). Também é possível passar uma função própria com a mesma assinatura.
+AGENDA_STRATEGIES = {
+    "salience": lambda rule, seq: (-rule.get("salience", 0), seq),  # Maior "salience" primeiro; empate por ordem de chegada
+    "specificity": lambda rule, seq: (-len(set(rule.get("symptoms", []))), seq),  # Regras com mais condições primeiro
+    "recency": lambda rule, seq: (-seq,),  # Ativação mais recente primeiro
+}
+
+class Agenda:
+    def __init__(self, strategy="salience"):
+        self.key = AGENDA_STRATEGIES[strategy] if isinstance(strategy, str) else strategy  # Função de prioridade
+        self._heap = []  # Fila de prioridade: (chave, sequência, regra)
+        self._live = {}  # id da regra -> sequência da sua ativação válida (as demais no heap foram retiradas)
+        self._seq = 0  # Contador de ativações
+
+    def add(self, rule):
+
+        # Insere a ativação de uma regra na agenda (O(log n)).
+
+        self._seq += 1
+        self._live[id(rule)] = self._seq
+        heapq.heappush(self._heap, (self.key(rule, self._seq), self._seq, rule))
+
+    def retract(self, rule):
+
+        # Retira a ativação de uma regra. A entrada no heap é descartada quando chegar ao topo (remoção preguiçosa).
+
+        self._live.pop(id(rule), None)
+
+    def pop(self):
+
+        # Retorna a próxima regra a disparar, ou None se a agenda estiver vazia.
+
+        while self._heap:
+            _, seq, rule = heapq.heappop(self._heap)
+            if self._live.get(id(rule)) == seq:
+                del self._live[id(rule)]
+                return rule
+        return None
+
+    def __len__(self):
+        return len(self._live)
+
+class ReteNetwork:
+    def __init__(self, rules=(), strategy="salience"):
+        self.alpha = {}  # Memória alfa: ID do fato -> nós de junção que o testam
+        self.root_children = []  # Nós de junção ligados diretamente à raiz
+        self.root_productions = []  # Regras de encadeamento sem condições
+        self._joins = {}  # (ID do nó pai, fato) -> nó de junção, para compartilhar prefixos
+        self.productions = 0  # Quantidade de regras de encadeamento na rede
+        self.strategy = strategy  # Estratégia de resolução de conflitos da agenda
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule):
+
+        # Adiciona à rede uma regra de encadeamento (regras sem "asserts" são ignoradas).
+        # :param rule: Dicionário com "id", "symptoms" (condições), "asserts" (fatos derivados) e,
+        #              opcionalmente, "salience" (prioridade na agenda).
+
+        if not rule.get("asserts"):
+            return
+        parent = None
+        # Ordem canônica (regras com o mesmo prefixo compartilham nós); a chave ordena juntos IDs inteiros e textos
+        for fact in sorted(set(rule.get("symptoms", [])), key=lambda f: (type(f).__name__, f)):
+            key = (parent.id if parent else None, fact)
+            node = self._joins.get(key)
+            if node is None:
+                node = JoinNode(len(self._joins), parent, fact)
+                self._joins[key] = node
+                (parent.children if parent else self.root_children).append(node)
+                self.alpha.setdefault(fact, []).append(node)
+            parent = node
+        (parent.productions if parent else self.root_productions).append(rule)
+        self.productions += 1
+
+    def run(self, facts, strategy=None):
+
+        # Executa o encadeamento para frente a partir dos fatos iniciais.
+        # :param facts: IDs dos fatos iniciais (sintomas do usuário).
+        # :param strategy: Estratégia da agenda para esta execução (padrão: a da rede).
+        # :return: A memória de trabalho final (WorkingMemory).
+
+        memory = WorkingMemory(self, strategy or self.strategy)
+        for fact in facts:
+            memory.assert_fact(fact)
+        memory.run()
+        return memory
+
+class WorkingMemory:
+    def __init__(self, network, strategy="salience"):
+        self.network = network
+        self.facts = set()  # Fatos conhecidos (iniciais e derivados)
+        self.derived = []  # Fatos derivados, na ordem em que foram inferidos
+        self.fired = []  # IDs das regras disparadas, na ordem de disparo
+        self._active = set()  # IDs dos nós de junção satisfeitos
+        self.agenda = Agenda(strategy)  # Regras prontas para disparar
+        for rule in network.root_productions:
+            self.agenda.add(rule)
+
+    def assert_fact(self, fact):
+
+        # Insere um fato na memória de trabalho e propaga a mudança pela rede.
+        # Só os nós de junção da memória alfa do fato são testados; os nós seguintes são visitados
+        # apenas se a cadeia anterior já estiver satisfeita. Regras completas entram na agenda.
+
+        if fact in self.facts:
+            return
+        self.facts.add(fact)
+        for node in self.network.alpha.get(fact, ()):
+            if node.parent is None or node.parent.id in self._active:
+                self._activate(node)
+
+    def retract_fact(self, fact):
+
+        # Remove um fato da memória de trabalho. Os nós de junção que dependiam dele deixam de estar
+        # satisfeitos e as ativações pendentes das regras correspondentes saem da agenda.
+
+        if fact not in self.facts:
+            return
+        self.facts.discard(fact)
+        if fact in self.derived:
+            self.derived.remove(fact)
+        for node in self.network.alpha.get(fact, ()):
+            if node.id in self._active:
+                self._deactivate(node)
+
+    def _activate(self, node):
+
+        # Marca um nó de junção como satisfeito e continua a propagação para seus filhos.
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            self._active.add(node.id)
+            for rule in node.productions:
+                self.agenda.add(rule)
+            stack.extend(child for child in node.children if child.fact in self.facts)
+
+    def _deactivate(self, node):
+
+        # Desfaz a satisfação de um nó de junção e de todos os seus descendentes satisfeitos.
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            self._active.discard(node.id)
+            for rule in node.productions:
+                self.agenda.retract(rule)
+            stack.extend(child for child in node.children if child.id in self._active)
+
+    def run(self):
+
+        # Dispara as regras da agenda, uma de cada vez, até não haver mais nada a inferir.
+
+        rule = self.agenda.pop()
+        while rule is not None:
+            self.fired.append(rule["id"])
+            for fact in rule["asserts"]:
+                if fact not in self.facts:
+                    self.derived.append(fact)
+                    self.assert_fact(fact)
+            rule = self.agenda.pop()
+
+# Recuperação aproximada (MinHash + LSH)
+# Para bases com centenas de milhares de regras, até o índice invertido devolve listas enormes para sintomas
+# comuns. Aqui, cada regra recebe uma assinatura MinHash do seu conjunto de sintomas, dividida em faixas
+# (bands) de `rows` valores; regras com alguma faixa idêntica à da consulta caem no mesmo balde e viram
+# candidatas. A probabilidade de uma regra com similaridade de Jaccard J ser recuperada é 1 - (1 - J^rows)^bands:
+# mais faixas (ou menos linhas por faixa) aumentam o recall, ao custo de mais candidatas.
+
+class MinHashLSH:
+    _PRIME = (1 << 61) - 1  # Primo de Mersenne usado nas funções de hash universais
+
+    def __init__(self, bands=64, rows=2, seed=1):
+        self.bands = bands  # Quantidade de faixas da assinatura
+        self.rows = rows  # Valores de MinHash por faixa
+        rng = random.Random(seed)  # Semente fixa: as assinaturas são reprodutíveis entre execuções
+        n = bands * rows
+        self._a = [rng.randrange(1, self._PRIME) for _ in range(n)]
+        self._b = [rng.randrange(0, self._PRIME) for _ in range(n)]
+        self._buckets = [{} for _ in range(bands)]  # Por faixa: valores da faixa -> posições das regras
+        self._owned = [set() for _ in range(bands)]  # Por faixa: baldes cujas listas pertencem a este índice
+
+    def copy(self):
+
+        # Retorna uma cópia do índice que pode receber novas regras sem alterar este (cópia na escrita).
+
+        index = copy.copy(self)
+        index._buckets = [dict(buckets) for buckets in self._buckets]
+        index._owned = [set() for _ in self._buckets]
+        return index
+
+    def signature(self, items):
+
+        # Calcula a assinatura MinHash de um conjunto de IDs (None para conjunto vazio).
+
+        if not items:
+            return None
+        # hash() de textos muda a cada processo (PYTHONHASHSEED); o CRC32 da forma JSON do ID é estável e ainda
+        # distingue 1 de "1", como a igualdade do Python faz
+        hashes = [zlib.crc32(json.dumps(x).encode('utf-8')) for x in items]
+        p = self._PRIME
+        return [min((a * h + b) % p for h in hashes) for a, b in zip(self._a, self._b)]
+
+    def add(self, pos, items):
+
+        # Indexa a regra da posição `pos` pelos seus sintomas.
+
+        sig = self.signature(set(items))
+        if sig is None:
+            return  # Regra sem sintomas nunca tem aderência
+        r = self.rows
+        for band, buckets in enumerate(self._buckets):
+            key = tuple(sig[band * r:(band + 1) * r])
+            if key not in self._owned[band]:
+                buckets[key] = list(buckets.get(key, ()))  # Lista própria antes de alterar
+                self._owned[band].add(key)
+            buckets[key].append(pos)
+
+    def candidates(self, user_set):
+
+        # Retorna, na ordem da base, as posições das regras que colidem com a consulta em ao menos uma faixa.
+
+        sig = self.signature(user_set)
+        if sig is None:
+            return []
+        found = set()
+        r = self.rows
+        for band, buckets in enumerate(self._buckets):
+            found.update(buckets.get(tuple(sig[band * r:(band + 1) * r]), ()))
+        return sorted(found)
+
+# Feedback no histórico
+def apply_feedback(history, rule_id, success, penalty_factor=0.1):
+
+    # Aplica o resultado de uma consulta ao histórico de uma regra.
+    # Se a solução for bem-sucedida, incrementa o sucesso. Caso contrário, penaliza a falha.
+    # :return: O ID da regra como string (chave do histórico).
+
+    rid = str(rule_id)
+    if rid not in history:
+        history[rid] = {"success": 0, "fail": 0}  # Se não houver histórico, inicializa com zero sucesso e falha
+
+    if success:
+        # Incrementa o número de sucessos
+        history[rid]["success"] = history[rid].get("success", 0) + 1
+    else:
+        # Incrementa o número de falhas, podendo aplicar uma penalização leve
+        history[rid]["fail"] = history[rid].get("fail", 0) + penalty_factor
+    return rid
+
+# Snapshot da base compilada
+# Todo o estado usado nas consultas (regras compiladas, rede Rete, índices, precisões) fica em um snapshot
+# que não é mais alterado depois de publicado. As consultas leem o snapshot atual uma única vez e trabalham
+# só com ele; as escritas (feedback, novas regras) montam um novo snapshot a partir do anterior (copiando
+# apenas o que muda) e o publicam com uma única atribuição, que é atômica. Assim, várias threads consultam
+# sem trava global e cada consulta vê uma versão consistente da base e do histórico (read-copy-update).
+
+class KBSnapshot:
+    def __init__(self, compiled, rete, solutions, symptoms, precisions, lsh, version, kb_version,
+                 feedback_log, feedback_base):
+        self.compiled = compiled  # Tabela de regras compiladas (CompiledRules)
+        self.rete = rete  # Rede Rete das regras de encadeamento
+        self.solutions = solutions  # Índice: ID da solução -> registro da solução
+        self.symptoms = symptoms  # Índice: ID do sintoma -> registro do sintoma
+        self.precisions = precisions  # Precisão histórica por posição da regra
+        self.lsh = lsh  # Índice MinHash/LSH (None no modo exato)
+        self.version = version  # Versão da base/histórico; muda a cada escrita
+        self.kb_version = kb_version  # Versão apenas da base; muda quando regras ou soluções mudam
+        self.feedback_log = feedback_log  # Log de posições com histórico alterado (só cresce entre podas)
+        self.feedback_base = feedback_base  # Quantas entradas antigas do log já foram descartadas
+        self.feedback_end = feedback_base + len(feedback_log)  # Fim do log visível neste snapshot
+        self.vector = None  # Matriz do backend NumPy, montada sob demanda
+        self.best_precision = None  # Limite superior da precisão histórica (cache usado na poda)
+
+    def derive(self, **changes):
+
+        # Retorna um novo snapshot com os campos informados alterados (os demais são compartilhados).
+
+        snap = copy.copy(self)
+        snap.__dict__.update(changes)
+        snap.feedback_end = snap.feedback_base + len(snap.feedback_log)
+        return snap
+
+    def feedback_since(self, offset):
+
+        # Retorna as posições das regras cujo histórico mudou desde a posição `offset` do log de feedback,
+        # ou None se essa parte do log já foi descartada.
+
+        if offset < self.feedback_base:
+            return None
+        return self.feedback_log[offset - self.feedback_base:self.feedback_end - self.feedback_base]
 
 # Motor de Inferência
 # O motor de inferência recebe os sintomas e aplica regras para sugerir soluções
 
 class InferenceEngine:
-    def __init__(self, kb, history):
-        self.kb = kb  # A base de conhecimento
-        self.history = history  # Histórico de feedbacks de soluções
-
-    def match_solutions(self, user_symptoms):
+    def __init__(self, kb, history, backend="python", cache_size=128, agenda_strategy="salience",
+                 retrieval="exact", lsh_bands=64, lsh_rows=2, compiled=None):
+
+        # :param backend: "python" (padrão) ou "numpy". Sem NumPy instalado, "numpy" recai no caminho em Python puro.
+        # :param cache_size: Capacidade do cache LRU de consultas (0 desativa o cache).
+        # :param agenda_strategy: Resolução de conflitos do encadeamento: "salience", "specificity", "recency"
+        #                         ou uma função (regra, sequência) -> chave de prioridade.
+        # :param retrieval: "exact" (índice invertido, padrão) ou "lsh" (candidatas aproximadas por MinHash/LSH,
+        #                   repontuadas com a fórmula exata).
+        # :param lsh_bands: Faixas do LSH (mais faixas = mais recall, mais candidatas).
+        # :param lsh_rows: Valores por faixa do LSH (mais linhas = menos candidatas, menos recall).
+        #                  O padrão (64 x 2) privilegia o recall: numa base de 200 mil regras, recuperou 90% do top 10
+        #                  exato (benchmark_lsh) em cerca de 60% do tempo do caminho exato; 32 x 2 recuperou 82%, e
+        #                  16 x 4, mais rápido, só 13%. Com 1 valor por faixa, o recall chega a 100%, mas a consulta
+        #                  deixa de ser mais rápida que a exata.
+        # :param compiled: Base compilada em arquivo (CompiledKB). Se informada, o motor é montado a partir dela,
+        #                  sem percorrer as regras, e `kb` pode ser None (a base em dicionários só é carregada,
+        #                  pelo próprio CompiledKB, quando o motor precisar alterá-la).
+        # O histórico pode ser um dicionário ou uma função que o retorna (ex.: Persistence.load_history), chamada
+        # só na primeira consulta. O vetor de precisões também só é montado na primeira consulta.
+
+        self._kb = kb  # A base de conhecimento
+        self._packed = compiled  # Base compilada em arquivo, se houver
+        self._history = history  # Histórico de feedbacks de soluções (ou função que o carrega)
+        self._history_lock = threading.Lock()
+        self.backend = "numpy" if backend == "numpy" and np is not None else "python"
+        self.agenda_strategy = agenda_strategy
+        self.stats = {"pruned_rules": 0}  # Contadores de desempenho (regras podadas sem serem pontuadas)
+        self.cache = QueryCache(cache_size)  # Cache de resultados de match_solutions
+        self.lock = threading.Lock()  # Serializa as escritas (as leituras não precisam dela)
+
+        if compiled is not None:
+            table = CompiledRules.from_packed(compiled)  # Tabela lida do arquivo mapeado
+            records = (compiled.records("sol"), compiled.records("sym"))
+            chaining = [compiled.rule(index) for index in compiled.chain_rules]
+            scored = (compiled.rule(index) for index in compiled.table_rule)
+        else:
+            table = CompiledRules(kb["rules"])  # Regras compiladas uma única vez, ao carregar a base
+            records = (kb["solutions"], kb["symptoms"])
+            chaining = kb["rules"]
+            scored = (rule for rule in kb["rules"] if "solution" in rule)
+        solutions = {}
+        symptoms = {}
+        for sol in records[0]:
+            solutions.setdefault(sol["id"], sol)  # Em IDs repetidos, vale o primeiro (como na busca linear)
+        for sym in records[1]:
+            symptoms.setdefault(sym["id"], sym)
+        lsh = None  # Índice MinHash/LSH, montado apenas no modo de recuperação "lsh"
+        if retrieval == "lsh":
+            lsh = MinHashLSH(lsh_bands, lsh_rows)
+            for pos, rule in enumerate(scored):
+                lsh.add(pos, rule.get("symptoms", []))
+
+        self._snapshot = KBSnapshot(
+            compiled=table,
+            rete=ReteNetwork(chaining, agenda_strategy),  # Rede Rete das regras de encadeamento (campo "asserts")
+            solutions=solutions,
+            symptoms=symptoms,
+            precisions=None,  # Montado na primeira consulta (veja _precisions)
+            lsh=lsh,
+            version=0,
+            kb_version=0,
+            feedback_log=[],
+            feedback_base=0
+        )
+
+    @property
+    def kb(self):
+
+        # A base de conhecimento em dicionários (carregada sob demanda quando o motor foi montado de uma base compilada).
+
+        if self._kb is None:
+            self._kb = self._packed.load_kb()
+        return self._kb
+
+    @property
+    def history(self):
+
+        # O histórico de feedback (carregado na primeira chamada quando o motor recebeu uma função de carga).
+
+        if callable(self._history):
+            with self._history_lock:
+                if callable(self._history):
+                    self._history = self._history()
+        return self._history
+
+    @history.setter
+    def history(self, history):
+        self._history = history
+
+    @property
+    def snapshot(self):
+
+        # Snapshot publicado mais recente (imutável).
+
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    @property
+    def kb_version(self):
+        return self._snapshot.kb_version
+
+    def add_rule(self, rule):
+
+        # Adiciona uma nova regra à base de conhecimento, a compila na tabela de regras e, se for uma
+        # regra de encadeamento, a insere na rede Rete. Publica um novo snapshot.
+        # :param rule: Dicionário com "id", "symptoms" e "solution" e/ou "asserts".
+
+        with self.lock:
+            snap = self._snapshot
+            self.kb["rules"].append(rule)
+            rete = snap.rete
+            if rule.get("asserts"):
+                rete = ReteNetwork(self.kb["rules"], self.agenda_strategy)  # Rede nova: a anterior segue em uso
+            compiled = snap.compiled.copy()
+            precisions = self._materialize(snap)
+            lsh = snap.lsh
+            pos = compiled.add(rule)
+            if pos is not None:
+                precisions = precisions + [self._get_precision(rule["id"])]
+                if lsh is not None:
+                    lsh = lsh.copy()
+                    lsh.add(pos, rule.get("symptoms", []))
+            self._snapshot = snap.derive(
+                compiled=compiled, rete=rete, precisions=precisions, lsh=lsh,
+                version=snap.version + 1,  # Invalida os resultados em cache
+                kb_version=snap.kb_version + 1,  # Sessões abertas refazem o ranking completo
+                vector=None,  # A matriz do backend NumPy será remontada na próxima consulta
+                best_precision=None  # O limite de precisão da poda é recalculado na próxima consulta
+            )
+
+    def add_solution(self, solution):
+
+        # Adiciona uma nova solução à base de conhecimento e ao índice de soluções.
+        # :param solution: Dicionário com "id" e "name".
+
+        with self.lock:
+            snap = self._snapshot
+            self.kb["solutions"].append(solution)
+            solutions = dict(snap.solutions)
+            solutions.setdefault(solution["id"], solution)
+            # O nome da solução pode aparecer em resultados em cache
+            self._snapshot = snap.derive(solutions=solutions, version=snap.version + 1, kb_version=snap.kb_version + 1)
+
+    def add_symptom(self, symptom):
+
+        # Adiciona um novo sintoma à base de conhecimento e ao índice de sintomas.
+        # :param symptom: Dicionário com "id" e "name".
+
+        with self.lock:
+            snap = self._snapshot
+            self.kb["symptoms"].append(symptom)
+            symptoms = dict(snap.symptoms)
+            symptoms.setdefault(symptom["id"], symptom)
+            self._snapshot = snap.derive(symptoms=symptoms)
+
+    def _precisions(self, snap):
+
+        # Retorna o vetor de precisões do snapshot, montando-o no primeiro uso (o que também carrega o histórico).
+        # A montagem segura a trava de escrita, para que o histórico não mude durante a leitura.
+
+        precisions = snap.precisions
+        if precisions is None:
+            with self.lock:
+                precisions = self._materialize(snap)
+        return precisions
+
+    def _materialize(self, snap):
+
+        # Monta o vetor de precisões do snapshot, se necessário: 0.5 sem histórico; só as regras presentes no
+        # histórico são calculadas. Deve ser chamado com self.lock (as escritas o montam antes de alterar o histórico).
+
+        if snap.precisions is None:
+            precisions = [0.5] * len(snap.compiled.rule_ids)
+            for rid in self.history:
+                for pos in snap.compiled.rule_positions.get(rid, ()):
+                    precisions[pos] = self._get_precision(rid)
+            snap.precisions = precisions
+        return snap.precisions
+
+    def _vectorized(self, snap):
+
+        # Retorna a matriz do backend NumPy do snapshot, montando-a se necessário.
+        # Duas threads podem montá-la ao mesmo tempo; o resultado é o mesmo e a atribuição é atômica.
+
+        vector = snap.vector
+        if vector is None:
+            vector = NumpyRules(snap.compiled, self._precisions(snap))
+            snap.vector = vector
+        return vector
+
+    def match_solutions(self, user_symptoms, top_k=None):
 
         # Retorna soluções ordenadas por score baseadas nos sintomas do usuário.
         # A aderência (match) é calculada como uma média ponderada entre precisão e recall usando F1 score.
         # Além disso, o histórico de precisão (suavizado) é levado em consideração no cálculo do score final.
         # :param user_symptoms: Lista de IDs dos sintomas fornecidos pelo usuário.
+        # :param top_k: Se informado, retorna apenas as top_k melhores soluções (seleção por heap, sem ordenar tudo).
+        #               Se None, retorna a lista completa.
         # :return: Lista de soluções possíveis, ordenadas por score.
 
-        matched = []  # Lista para armazenar as soluções com seus scores e detalhes
+        snap = self._snapshot  # Toda a consulta usa o mesmo snapshot
         user_set = set(user_symptoms) if user_symptoms else set()  # Converte os sintomas do usuário para um conjunto para facilitar as comparações
 
-        # Percorre todas as regras na base de conhecimento
-        for rule in self.kb["rules"]:
-            rule_set = set(rule.get("symptoms", []))  # Conjunto de sintomas associados à regra
-            intersection = len(rule_set & user_set)  # Interseção entre os sintomas da regra e os sintomas fornecidos pelo usuário
+        # Consultas repetidas (mesmo conjunto de sintomas, mesma versão) são respondidas pelo cache
+        key = (frozenset(user_set), top_k)
+        matched = self.cache.get(key, snap.version)
+        if matched is None:
+            user_set, derived = self._facts(snap, user_set)  # Fatos derivados pelas regras de encadeamento
+            if self.backend == "numpy" and snap.lsh is None:
+                matched = self._match_numpy(snap, user_set, top_k, derived)
+            else:
+                matched = self._match_python(snap, user_set, top_k, derived)
+            self.cache.put(key, snap.version, matched)
+
+        return [dict(m) for m in matched]  # Cópias: quem chama pode alterar o resultado sem afetar o cache
+
+    def match_solutions_batch(self, symptom_lists, top_k=None):
+
+        # Pontua várias consultas de uma só vez, compartilhando as regras compiladas entre elas.
+        # No backend NumPy, o lote inteiro é pontuado como um único produto matriz de consultas x matriz de regras.
+        # :param symptom_lists: Lista de listas de IDs de sintomas (uma por consulta).
+        # :param top_k: Se informado, limita cada resultado às top_k melhores soluções.
+        # :return: Lista de resultados, na mesma ordem das consultas, no mesmo formato de match_solutions.
+
+        snap = self._snapshot
+        facts = [self._facts(snap, set(symptoms) if symptoms else set()) for symptoms in symptom_lists]
+        return self._match_facts(snap, facts, top_k)
+
+    def _match_facts(self, snap, facts, top_k=None):
+
+        # Pontua um lote de consultas cujos fatos derivados já foram calculados.
+        # :param facts: Lista de pares (sintomas do usuário, fatos derivados), como os retornados por _facts.
+
+        if self.backend == "numpy" and snap.lsh is None:
+            queries, *columns = self._vectorized(snap).score_batch([f[0] for f in facts], [f[1] for f in facts])
+            bounds = np.searchsorted(queries, np.arange(len(facts) + 1))  # Fatia de cada consulta nos arrays
+            return [self._numpy_results(snap, [c[start:end] for c in columns], top_k)
+                    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+        return [self._match_python(snap, user_set, top_k, derived) for user_set, derived in facts]
+
+    def infer(self, user_symptoms):
+
+        # Executa o encadeamento para frente (rede Rete) a partir dos sintomas do usuário.
+        # :param user_symptoms: Lista de IDs dos sintomas fornecidos pelo usuário.
+        # :return: Memória de trabalho com os fatos conhecidos, os fatos derivados e as regras disparadas.
+
+        return self._snapshot.rete.run(set(user_symptoms) if user_symptoms else set())
+
+    def _facts(self, snap, user_set):
+
+        # Retorna os fatos usados na pontuação: o par (sintomas do usuário, fatos derivados que não foram informados).
+        # Sem regras de encadeamento na base, não há fatos derivados.
+
+        if not snap.rete.productions:
+            return user_set, frozenset()
+        return user_set, frozenset(snap.rete.run(user_set).facts - user_set)
+
+    def _match_python(self, snap, user_set, top_k=None, derived=frozenset()):
+
+        # Caminho em Python puro: percorre as regras candidatas e calcula os scores com máscaras de bits.
+        # No modo "lsh", as candidatas vêm do índice MinHash/LSH em vez do índice invertido.
+
+        candidates = snap.lsh.candidates(user_set | derived) if snap.lsh is not None else None
+        candidates, score_rule, f1_bound = self._scorer(snap, user_set, candidates, derived)
+        if top_k is not None and top_k > 0:
+            return self._branch_and_bound(snap, candidates, score_rule, f1_bound, top_k)
 
-            if not rule_set:
-                # Se a regra não tem sintomas, seu match é 0
+        entries = (entry for entry in map(score_rule, candidates) if entry is not None)
+        return self._rank(snap, entries, top_k)
+
+    def _scorer(self, snap, user_set, candidates=None, derived=frozenset()):
+
+        # Prepara a pontuação de uma consulta no caminho em Python puro.
+        # :param candidates: Posições candidatas já conhecidas (padrão: as do índice invertido).
+        # :param derived: Fatos derivados pelo encadeamento (fora de `user_set`).
+        # :return: Tupla (posições candidatas, função que pontua uma posição, limite do F1 por tamanho de regra).
+        #          A função retorna a entrada (score arredondado, posição, score, precisão histórica, match,
+        #          precision_rule, recall_user), ou None se a regra não tiver aderência.
+
+        table = snap.compiled
+        precisions = self._precisions(snap)
+        user_mask = table.query_mask(user_set)  # Máscara de bits dos sintomas do usuário
+        derived_mask = table.query_mask(derived) if derived else 0  # Máscara dos fatos derivados
+        query_mask = user_mask | derived_mask
+        # Sintomas desconhecidos pela base também contam para o recall. Os fatos derivados só contam para as regras
+        # que os testam: o recall é a fração de (sintomas informados + fatos derivados da regra) coberta por ela, então
+        # uma regra de encadeamento que dispara não altera a pontuação das regras que não usam o fato derivado
+        n_user = len(user_set)
+        n_known = user_mask.bit_count()
+        n_derived = derived_mask.bit_count()
+
+        def score_rule(pos):
+            # Interseção entre os sintomas da regra e os fatos da consulta, contada diretamente nos bits
+            intersection = (table.masks[pos] & query_mask).bit_count()
+
+            # Calcula a precisão da regra (quanto da regra foi coberta pelos sintomas fornecidos)
+            precision_rule = intersection / table.sizes[pos]
+            # Calcula o recall do usuário (quanto dos sintomas fornecidos foram cobertos pela regra)
+            recall_user = intersection / (n_user + (table.masks[pos] & derived_mask).bit_count())
+
+            # Se tanto precisão quanto recall forem zero, a aderência será zero
+            if precision_rule + recall_user == 0:
                 match = 0.0
-                precision_rule = 0.0
-                recall_user = 0.0
             else:
-                # Calcula a precisão da regra (quanto da regra foi coberta pelos sintomas fornecidos)
-                precision_rule = intersection / len(rule_set)
-                # Calcula o recall do usuário (quanto dos sintomas fornecidos foram cobertos pela regra)
-                recall_user = intersection / len(user_set) if len(user_set) > 0 else 0.0
-
-                # Se tanto precisão quanto recall forem zero, a aderência será zero
-                if precision_rule + recall_user == 0:
-                    match = 0.0
-                else:
-                    # F1 score (média harmônica entre precisão e recall)
-                    match = 2 * (precision_rule * recall_user) / (precision_rule + recall_user)
+                # F1 score (média harmônica entre precisão e recall)
+                match = 2 * (precision_rule * recall_user) / (precision_rule + recall_user)
+
+            # Remove soluções sem aderência
+            if round(match, 4) <= 0:
+                return None
 
             # Considera a precisão histórica (a "experiência" passada sobre a eficácia da regra)
-            hist_precision = self._get_precision(rule["id"])
+            hist_precision = precisions[pos]
             # O score final é uma combinação do match (aderência) e a precisão histórica
             score = match * hist_precision
+            return (round(score, 4), pos, score, hist_precision, match, precision_rule, recall_user)
+
+        def f1_bound(size):
+            # Limite do F1 de uma regra de tamanho |R| que testa d fatos derivados: 2*min(|R|, |U| + d)/(|R| + |U| + d)
+            # (|U| conta só os sintomas conhecidos no numerador). O limite cresce com d até d = |R| - |U|
+            d = min(max(size - n_known, 0), n_derived)
+            return 2 * min(size, n_known + d) / (size + n_user + d)
+
+        # Apenas as regras candidatas (índice invertido), na ordem da base de conhecimento
+        if candidates is None:
+            candidates = table.candidates(user_set | derived if derived else user_set)
+        return candidates, score_rule, f1_bound
+
+    def _branch_and_bound(self, snap, candidates, score_rule, f1_bound, top_k):
+
+        # Seleciona as top_k regras sem pontuar as que não têm chance de entrar no resultado.
+        # Para uma regra de tamanho |R|, o F1 é limitado por `f1_bound` (veja _scorer), e a precisão histórica
+        # pela melhor precisão do histórico.
+        # As regras são agrupadas por tamanho e os grupos visitados em ordem decrescente desse limite;
+        # a busca para quando nenhum grupo restante pode superar o k-ésimo score atual.
+        # :return: Lista de soluções (top_k), na mesma ordem de match_solutions.
+
+        table = snap.compiled
+        buckets = {}
+        for pos in candidates:
+            buckets.setdefault(table.sizes[pos], []).append(pos)
+
+        best_precision = self._precision_bound(snap)
+        bounds = sorted(((f1_bound(size) * best_precision, size) for size in buckets),
+                        reverse=True)
+
+        selected = []  # Heap mínimo com as top_k atuais: (score arredondado, -posição, entrada)
+        remaining = len(candidates)
+        for bound, size in bounds:
+            # Folga relativa cobre os erros de ponto flutuante do cálculo exato do score
+            if len(selected) == top_k and round(bound * (1 + 1e-9), 4) < selected[0][0]:
+                break  # Nenhuma regra restante alcança o k-ésimo score (empates ainda são visitados)
+
+            positions = buckets[size]
+            remaining -= len(positions)
+            for pos in positions:
+                entry = score_rule(pos)
+                if entry is None:
+                    continue
+                item = (entry[0], -pos, entry)  # Em empate de score, vence a regra que vem antes na base
+                if len(selected) < top_k:
+                    heapq.heappush(selected, item)
+                elif item[:2] > selected[0][:2]:
+                    heapq.heapreplace(selected, item)
+
+        self.stats["pruned_rules"] += remaining  # Regras descartadas sem serem pontuadas (contador aproximado entre threads)
+        selected.sort(key=itemgetter(0, 1), reverse=True)
+        return [self._result(snap, item[2]) for item in selected]
+
+    def _precision_bound(self, snap):
+
+        # Retorna um limite superior para a precisão histórica de qualquer regra: a maior precisão do
+        # vetor de precisões do snapshot. O valor fica em cache no snapshot.
+
+        if snap.best_precision is None:
+            snap.best_precision = max(self._precisions(snap), default=0.5)
+        return snap.best_precision
+
+    def _match_numpy(self, snap, user_set, top_k=None, derived=frozenset()):
+
+        # Versão vetorizada de match_solutions: os scores de todas as regras vêm de operações de array.
 
-            # Encontra a solução associada à regra
-            sol = self._find_solution(rule["solution"])
-            # Adiciona a solução com seus detalhes ao resultado final
-            matched.append({
-                "rule_id": rule["id"],
-                "solution": sol["name"],
-                "score": round(score, 4),  # Score final, arredondado
-                "precision": round(hist_precision, 3),  # Precisão histórica
-                "match": round(match, 4),  # Aderência (F1 score)
-                "rule_precision": round(precision_rule, 4),  # Precisão da regra
-                "user_recall": round(recall_user, 4)  # Recall do usuário
-            })
+        return self._numpy_results(snap, self._vectorized(snap).score(user_set, derived), top_k)
 
-        # Remove soluções com score igual a 0 (sem aderência)
-        matched = [m for m in matched if m["match"] > 0]
+    def _numpy_results(self, snap, columns, top_k=None):
 
-        # Ordena as soluções por score (do maior para o menor)
-        matched.sort(key=lambda x: x["score"], reverse=True)
+        # Converte os arrays de uma consulta (posições, precision_rule, recall_user, match, score,
+        # precisão histórica) na lista ordenada de soluções. O arredondamento final usa round() do Python
+        # para que o resultado (e a ordem) seja idêntico ao do caminho em Python puro.
 
-        return matched
+        positions, precision_rule, recall_user, match, score, hist_precision = columns
+
+        # Com top_k, descarta de forma vetorizada as regras que certamente ficam fora do top_k.
+        # np.round difere de round() em no máximo uma casa (1e-4), então a margem de 2.5e-4 preserva
+        # todas as candidatas reais; o desempate exato é feito depois, em Python.
+        if top_k is not None and len(score) > top_k:
+            if top_k <= 0:
+                return []
+            approx = np.round(score, 4)
+            kth = np.partition(approx, -top_k)[-top_k]
+            keep = approx >= kth - 2.5e-4
+            columns = [c[keep] for c in columns]
+
+        def entries():
+            for pos, p, r, m, sc, h in zip(*(c.tolist() for c in columns)):
+                if round(m, 4) <= 0:
+                    continue  # Mesmo filtro do caminho em Python puro
+                yield (round(sc, 4), pos, sc, h, m, p, r)
+
+        return self._rank(snap, entries(), top_k)
+
+    def _rank(self, snap, entries, top_k=None):
+
+        # Ordena as entradas (score arredondado, posição, ...) por score, do maior para o menor.
+        # Empates mantêm a ordem da base de conhecimento (ordenação estável). Com top_k, usa seleção
+        # por heap (O(n log k)) e só monta os dicionários das soluções selecionadas.
+
+        if top_k is None:
+            ranked = sorted(entries, key=itemgetter(0), reverse=True)
+        else:
+            ranked = heapq.nlargest(top_k, entries, key=itemgetter(0))  # Equivale a sorted(...)[:top_k], estável
+        return [self._result(snap, entry) for entry in ranked]
+
+    def _result(self, snap, entry):
+
+        # Monta o dicionário de resultado de uma regra pontuada.
+
+        _, pos, score, hist_precision, match, precision_rule, recall_user = entry
+        table = snap.compiled
+        # Encontra a solução associada à regra (índice de soluções, O(1))
+        sol = snap.solutions.get(table.solution_ids[pos], {"name": "Solução desconhecida"})
+        return {
+            "rule_id": table.rule_ids[pos],
+            "solution": sol["name"],
+            "score": round(score, 4),  # Score final, arredondado
+            "precision": round(hist_precision, 3),  # Precisão histórica
+            "match": round(match, 4),  # Aderência (F1 score)
+            "rule_precision": round(precision_rule, 4),  # Precisão da regra
+            "user_recall": round(recall_user, 4)  # Recall do usuário
+        }
 
     def _get_precision(self, rule_id):
         
@@ -218,30 +2351,447 @@ class InferenceEngine:
         # :param sol_id: ID da solução a ser procurada.
         # :return: O nome da solução ou uma solução desconhecida.
         
-        # Procura a solução na base de conhecimento pelo ID
-        for s in self.kb["solutions"]:
-            if s["id"] == sol_id:
-                return s
-        return {"name": "Solução desconhecida"}  # Se não encontrar a solução, retorna "desconhecida"
+        # Consulta o índice de soluções (O(1)); se não encontrar, retorna "desconhecida"
+        return self._snapshot.solutions.get(sol_id, {"name": "Solução desconhecida"})
+
+    def _find_symptom(self, symptom_id):
+
+        # Encontra o sintoma associado a um ID de sintoma.
+        # :param symptom_id: ID do sintoma a ser procurado.
+        # :return: O registro do sintoma ou um sintoma desconhecido.
+
+        return self._snapshot.symptoms.get(symptom_id, {"name": "Sintoma desconhecido"})
 
     def update_history(self, rule_id, success, penalty_factor=0.1):
         
         # Atualiza o histórico com o resultado de uma consulta.
         # Se a solução for bem-sucedida, incrementa o sucesso. Caso contrário, penaliza a falha.
+        # Apenas as entradas da regra no vetor de precisões são recalculadas.
         # :param rule_id: ID da regra para atualizar o histórico.
         # :param success: Booleano indicando se a solução foi bem-sucedida.
         # :param penalty_factor: Fator de penalização para falhas (por padrão 0.1).
         
-        rid = str(rule_id)
-        if rid not in self.history:
-            self.history[rid] = {"success": 0, "fail": 0}  # Se não houver histórico, inicializa com zero sucesso e falha
-        
-        if success:
-            # Incrementa o número de sucessos
-            self.history[rid]["success"] = self.history[rid].get("success", 0) + 1
+        self.update_history_many([(rule_id, success, penalty_factor)])
+
+    def update_history_many(self, updates):
+
+        # Aplica vários feedbacks e publica um único snapshot novo (uma cópia do vetor de precisões por lote).
+        # :param updates: Lista de tuplas (rule_id, success, penalty_factor).
+
+        with self.lock:
+            snap = self._snapshot
+            self._materialize(snap)  # Antes de alterar o histórico: o snapshot atual não pode ver o feedback novo
+            changed = {}  # Posição -> nova precisão
+            for rule_id, success, penalty_factor in updates:
+                rid = apply_feedback(self.history, rule_id, success, penalty_factor)
+                new_precision = self._get_precision(rid)
+                for pos in snap.compiled.rule_positions.get(rid, ()):
+                    changed[pos] = new_precision
+                    snap.feedback_log.append(pos)  # Snapshots antigos só enxergam o log até o seu fim
+
+            precisions = list(snap.precisions)
+            for pos, precision in changed.items():
+                precisions[pos] = precision
+
+            # Mantém o limite de precisão usado na poda (branch-and-bound) válido
+            best_precision = snap.best_precision
+            if best_precision is not None and changed:
+                if max(changed.values()) >= best_precision:
+                    best_precision = max(changed.values())
+                elif any(snap.precisions[pos] >= best_precision for pos in changed):
+                    best_precision = None  # A maior precisão pode ter caído: recalcula na próxima consulta
+
+            # Mantém o vetor do backend NumPy sincronizado (cópia com as novas precisões)
+            vector = snap.vector.with_precisions(changed) if snap.vector is not None else None
+
+            # Limita o log de feedback; sessões que ficarem para trás refazem o ranking completo
+            feedback_log, feedback_base = snap.feedback_log, snap.feedback_base
+            if len(feedback_log) > 4096:
+                half = len(feedback_log) // 2
+                feedback_log, feedback_base = feedback_log[half:], feedback_base + half  # Lista nova: a antiga segue válida
+
+            self._snapshot = snap.derive(
+                precisions=precisions, best_precision=best_precision, vector=vector,
+                feedback_log=feedback_log, feedback_base=feedback_base,
+                version=snap.version + 1  # Invalida os resultados em cache
+            )
+
+    def feedback_since(self, offset):
+
+        # Retorna as posições das regras cujo histórico mudou desde a posição `offset` do log de feedback,
+        # ou None se essa parte do log já foi descartada.
+
+        return self._snapshot.feedback_since(offset)
+
+    def feedback_offset(self):
+
+        # Retorna a posição atual do log de feedback (para usar em feedback_since).
+
+        return self._snapshot.feedback_end
+
+    def session(self, user_symptoms):
+
+        # Abre uma sessão de diagnóstico para os sintomas informados (veja DiagnosisSession).
+
+        return DiagnosisSession(self, user_symptoms)
+
+# Sessão de diagnóstico
+# Mantém o último ranking de uma consulta e, após feedback, corrige apenas as posições das regras cujo
+# histórico mudou, em vez de recalcular todos os scores. Útil em sessões sem interface, em que a mesma
+# consulta é repetida ("e agora?") depois de cada feedback.
+
+class DiagnosisSession:
+    def __init__(self, engine, user_symptoms):
+        self.engine = engine  # Motor de inferência usado pela sessão
+        self.user_symptoms = set(user_symptoms) if user_symptoms else set()  # Sintomas da consulta
+        self._entries = None  # Posição da regra -> entrada pontuada (mesmo formato do motor)
+        self._order = []  # Chaves (-score arredondado, posição), em ordem de ranking
+        self._kb_version = None  # Versão da base em que o ranking foi calculado
+        self._offset = 0  # Posição do log de feedback já aplicada ao ranking
+
+    def rank(self, top_k=None):
+
+        # Retorna o ranking atual da consulta, no mesmo formato (e ordem) de match_solutions.
+        # :param top_k: Se informado, retorna apenas as top_k melhores soluções.
+
+        snap = self.engine.snapshot
+        changed = snap.feedback_since(self._offset)
+        if self._entries is None or self._kb_version != snap.kb_version or changed is None:
+            self._rebuild(snap)
         else:
-            # Incrementa o número de falhas, podendo aplicar uma penalização leve
-            self.history[rid]["fail"] = self.history[rid].get("fail", 0) + penalty_factor
+            self._repair(snap, changed)
+        self._offset = snap.feedback_end
+
+        order = self._order if top_k is None else self._order[:max(top_k, 0)]
+        return [self.engine._result(snap, self._entries[pos]) for _, pos in order]
+
+    def feedback(self, rule_id, success, penalty_factor=0.1):
+
+        # Registra o feedback de uma solução no motor; o ranking é corrigido na próxima chamada de rank().
+
+        self.engine.update_history(rule_id, success, penalty_factor)
+
+    def _rebuild(self, snap):
+
+        # Calcula o ranking completo da consulta (com os fatos derivados pela base atual).
+
+        user_set, derived = self.engine._facts(snap, self.user_symptoms)
+        candidates, score_rule, _ = self.engine._scorer(snap, user_set, derived=derived)
+        self._entries = {}
+        for entry in map(score_rule, candidates):
+            if entry is not None:
+                self._entries[entry[1]] = entry
+        self._order = sorted((-entry[0], pos) for pos, entry in self._entries.items())
+        self._kb_version = snap.kb_version
+
+    def _repair(self, snap, changed):
+
+        # Recalcula apenas as regras cujo histórico mudou e as reposiciona no ranking (busca binária).
+        # A aderência (match) não depende do histórico, então só o score final precisa ser refeito.
+
+        precisions = self.engine._precisions(snap)
+        for pos in set(changed):
+            entry = self._entries.get(pos)
+            if entry is None:
+                continue  # A regra não faz parte desta consulta
+            _, _, _, _, match, precision_rule, recall_user = entry
+            hist_precision = precisions[pos]
+            score = match * hist_precision
+            new_entry = (round(score, 4), pos, score, hist_precision, match, precision_rule, recall_user)
+            self._entries[pos] = new_entry
+
+            if new_entry[0] != entry[0]:
+                del self._order[bisect.bisect_left(self._order, (-entry[0], pos))]
+                bisect.insort(self._order, (-new_entry[0], pos))
+
+# Motor de inferência particionado (vários processos)
+# Um único processo Python usa apenas um núcleo. Aqui, kb["rules"] é dividida em fatias contíguas, cada uma
+# compilada por um InferenceEngine em um processo próprio. Cada consulta (ou lote) é enviada a todas as
+# partições, que devolvem seus top_k locais; os resultados são intercalados por score. Como as fatias são
+# contíguas, o desempate pela ordem da base continua o mesmo. O feedback vai apenas para a partição dona da regra.
+
+def _shard_worker(conn, kb, history, options):
+
+    # Laço de um processo de partição: recebe comandos pelo pipe e responde com o resultado (ou o erro).
+    # Ignora o Ctrl+C (enviado a todo o grupo de processos): quem encerra as partições é o processo principal.
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    engine = InferenceEngine(kb, history, cache_size=0, **options)
+    while True:
+        try:
+            command, args = conn.recv()
+        except EOFError:
+            return  # O processo principal terminou sem enviar "close"
+        if command == "close":
+            conn.close()
+            return
+        try:
+            if command == "match":
+                result = engine._match_facts(engine.snapshot, *args)  # Fatos derivados já calculados pelo motor principal
+            elif command == "feedback":
+                result = engine.update_history(*args)
+            elif command == "add_rule":
+                result = engine.add_rule(*args)
+            elif command == "add_solution":
+                result = engine.add_solution(*args)
+            else:
+                raise ValueError(f"Comando desconhecido: {command}")
+            conn.send(("ok", result))
+        except Exception as exc:
+            conn.send(("error", repr(exc)))
+
+class ShardedInferenceEngine:
+    def __init__(self, kb, history, shards=2, cache_size=128, agenda_strategy="salience", compiled=None, **options):
+
+        # Mesma interface de InferenceEngine, com as regras pontuadas repartidas entre `shards` processos.
+        # O histórico pode ser um dicionário ou uma função que o retorna (ex.: Persistence.load_history); com
+        # `compiled` (CompiledKB), `kb` pode ser None. O histórico é lido já na criação, para repartir as regras.
+        # :param options: Demais opções repassadas ao InferenceEngine de cada partição (backend, retrieval...).
+
+        if kb is None:
+            kb = compiled.load_kb()
+        if callable(history):
+            history = history()
+        self.kb = kb  # A base de conhecimento completa
+        self.history = history  # Histórico completo (mantido também aqui, para a persistência)
+        self.agenda_strategy = agenda_strategy
+        self.stats = {}
+        self.cache = QueryCache(cache_size)
+        self.lock = threading.Lock()  # Serializa as escritas (as leituras não precisam dela)
+        self._pipes = threading.Lock()  # Serializa as trocas de mensagens com as partições (pipes compartilhados)
+
+        solutions = {}
+        symptoms = {}
+        for sol in kb["solutions"]:
+            solutions.setdefault(sol["id"], sol)
+        for sym in kb["symptoms"]:
+            symptoms.setdefault(sym["id"], sym)
+
+        # Regras pontuadas (com solução), sem o campo "asserts": os fatos derivados chegam prontos nas consultas
+        scored = [{k: v for k, v in rule.items() if k != "asserts"} for rule in kb["rules"] if "solution" in rule]
+        shards = max(1, min(shards, len(scored)))
+        size = (len(scored) + shards - 1) // shards
+        self._owner = {}  # ID da regra (string) -> partições que a contêm
+        self._positions = {}  # ID da regra (string) -> posições na ordem das regras pontuadas (como em CompiledRules)
+        self._scored = len(scored)
+        self._conns = []
+        self._workers = []
+        for index in range(shards):
+            chunk = scored[index * size:(index + 1) * size]
+            for offset, rule in enumerate(chunk, index * size):
+                self._owner.setdefault(str(rule["id"]), set()).add(index)
+                self._positions.setdefault(str(rule["id"]), []).append(offset)
+            shard_kb = {"symptoms": kb["symptoms"], "solutions": kb["solutions"], "rules": chunk}
+            shard_history = {str(r["id"]): history[str(r["id"])] for r in chunk if str(r["id"]) in history}
+            parent_conn, child_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_shard_worker, args=(child_conn, shard_kb, shard_history, options),
+                                             daemon=True)
+            worker.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._workers.append(worker)
+
+        # Snapshot com o estado lido nas consultas deste processo; regras compiladas e precisões ficam nas partições
+        self._snapshot = KBSnapshot(
+            compiled=None,
+            rete=ReteNetwork(kb["rules"], agenda_strategy),  # O encadeamento roda aqui; as partições só pontuam
+            solutions=solutions,
+            symptoms=symptoms,
+            precisions=None,
+            lsh=None,
+            version=0,
+            kb_version=0,
+            feedback_log=[],
+            feedback_base=0
+        )
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def rete(self):
+        return self._snapshot.rete
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    @property
+    def kb_version(self):
+        return self._snapshot.kb_version
+
+    def _call(self, indexes, command, *args):
+
+        # Envia o comando às partições indicadas (todas de uma vez) e depois coleta as respostas.
+        # Uma troca por vez: respostas de comandos de threads diferentes não podem se misturar nos pipes.
+
+        with self._pipes:
+            for index in indexes:
+                self._conns[index].send((command, args))
+            results = []
+            errors = []
+            for index in indexes:
+                status, result = self._conns[index].recv()  # Lê todas as respostas, mesmo após um erro
+                if status != "ok":
+                    errors.append(f"Erro na partição {index}: {result}")
+                results.append(result)
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        return results
+
+    def match_solutions(self, user_symptoms, top_k=None):
+
+        # Mesmo contrato de InferenceEngine.match_solutions.
+
+        version = self._snapshot.version
+        user_set = set(user_symptoms) if user_symptoms else set()
+        key = (frozenset(user_set), top_k)
+        matched = self.cache.get(key, version)
+        if matched is None:
+            matched = self.match_solutions_batch([user_set], top_k)[0]
+            self.cache.put(key, version, matched)
+        return [dict(m) for m in matched]
+
+    def match_solutions_batch(self, symptom_lists, top_k=None):
+
+        # Espalha o lote para todas as partições e intercala os top_k locais de cada consulta.
+
+        snap = self._snapshot
+        facts = [self._facts(snap, set(symptoms) if symptoms else set()) for symptoms in symptom_lists]
+        per_shard = self._call(range(len(self._conns)), "match", facts, top_k)
+        results = []
+        for lists in zip(*per_shard):
+            # heapq.merge é estável entre as entradas: em empate, vence a partição anterior (ordem da base)
+            merged = heapq.merge(*lists, key=lambda m: -m["score"])
+            results.append(list(merged) if top_k is None else list(itertools.islice(merged, max(top_k, 0))))
+        return results
+
+    def update_history(self, rule_id, success, penalty_factor=0.1):
+
+        # Atualiza o histórico local e encaminha o feedback só para a(s) partição(ões) dona(s) da regra.
+
+        self.update_history_many([(rule_id, success, penalty_factor)])
+
+    def update_history_many(self, updates):
+
+        # Aplica vários feedbacks (tuplas (rule_id, success, penalty_factor)) e publica um único snapshot novo.
+
+        with self.lock:
+            snap = self._snapshot
+            for rule_id, success, penalty_factor in updates:
+                rid = apply_feedback(self.history, rule_id, success, penalty_factor)
+                snap.feedback_log.extend(self._positions.get(rid, ()))  # Snapshots antigos só enxergam o log até o seu fim
+                self._call(sorted(self._owner.get(rid, ())), "feedback", rule_id, success, penalty_factor)
+            feedback_log, feedback_base = snap.feedback_log, snap.feedback_base
+            if len(feedback_log) > 4096:
+                half = len(feedback_log) // 2
+                feedback_log, feedback_base = feedback_log[half:], feedback_base + half
+            self._snapshot = snap.derive(feedback_log=feedback_log, feedback_base=feedback_base,
+                                         version=snap.version + 1)
+
+    def add_rule(self, rule):
+
+        # Novas regras vão para a última partição, preservando a ordem da base entre as partições.
+
+        with self.lock:
+            snap = self._snapshot
+            self.kb["rules"].append(rule)
+            rete = snap.rete
+            if rule.get("asserts"):
+                rete = ReteNetwork(self.kb["rules"], self.agenda_strategy)  # Rede nova: a anterior segue em uso
+            if "solution" in rule:
+                last = len(self._conns) - 1
+                self._owner.setdefault(str(rule["id"]), set()).add(last)
+                self._positions.setdefault(str(rule["id"]), []).append(self._scored)
+                self._scored += 1
+                self._call([last], "add_rule", {k: v for k, v in rule.items() if k != "asserts"})
+            self._snapshot = snap.derive(rete=rete, version=snap.version + 1, kb_version=snap.kb_version + 1)
+
+    def add_solution(self, solution):
+
+        with self.lock:
+            snap = self._snapshot
+            self.kb["solutions"].append(solution)
+            solutions = dict(snap.solutions)
+            solutions.setdefault(solution["id"], solution)
+            self._call(range(len(self._conns)), "add_solution", solution)
+            self._snapshot = snap.derive(solutions=solutions, version=snap.version + 1, kb_version=snap.kb_version + 1)
+
+    def add_symptom(self, symptom):
+
+        with self.lock:
+            snap = self._snapshot
+            self.kb["symptoms"].append(symptom)  # As partições não usam nomes de sintomas
+            symptoms = dict(snap.symptoms)
+            symptoms.setdefault(symptom["id"], symptom)
+            self._snapshot = snap.derive(symptoms=symptoms)
+
+    def feedback_since(self, offset):
+
+        # Mesmo contrato de InferenceEngine.feedback_since (posições na ordem das regras pontuadas).
+
+        return self._snapshot.feedback_since(offset)
+
+    def feedback_offset(self):
+        return self._snapshot.feedback_end
+
+    def session(self, user_symptoms):
+
+        # Abre uma sessão de diagnóstico para os sintomas informados (veja ShardedSession).
+
+        return ShardedSession(self, user_symptoms)
+
+    def infer(self, user_symptoms):
+        return self._snapshot.rete.run(set(user_symptoms) if user_symptoms else set())
+
+    def _facts(self, snap, user_set):
+        if not snap.rete.productions:
+            return user_set, frozenset()
+        return user_set, frozenset(snap.rete.run(user_set).facts - user_set)
+
+    def _find_solution(self, sol_id):
+        return self._snapshot.solutions.get(sol_id, {"name": "Solução desconhecida"})
+
+    def _find_symptom(self, symptom_id):
+        return self._snapshot.symptoms.get(symptom_id, {"name": "Sintoma desconhecido"})
+
+    def close(self):
+
+        # Encerra os processos das partições.
+
+        with self._pipes:
+            for conn in self._conns:
+                try:
+                    conn.send(("close", ()))
+                    conn.close()
+                except (OSError, BrokenPipeError):
+                    pass
+            for worker in self._workers:
+                worker.join(timeout=5)
+            self._conns = []
+            self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Sessão de diagnóstico do motor particionado
+# Mesma interface de DiagnosisSession. Os scores ficam nas partições, então o ranking é refeito pelo motor
+# (e respondido pelo cache enquanto a versão não mudar) em vez de corrigido posição a posição.
+
+class ShardedSession:
+    def __init__(self, engine, user_symptoms):
+        self.engine = engine  # Motor particionado usado pela sessão
+        self.user_symptoms = set(user_symptoms) if user_symptoms else set()  # Sintomas da consulta
+
+    def rank(self, top_k=None):
+        return self.engine.match_solutions(self.user_symptoms, top_k)
+
+    def feedback(self, rule_id, success, penalty_factor=0.1):
+        self.engine.update_history(rule_id, success, penalty_factor)
 
 # Paginação para a UI
 def paginate_list(items, page_size):
@@ -278,6 +2828,14 @@ class ConsoleUI:
         
         self.persistence = persistence
         self.engine = engine
+
+    def _fact_name(self, fact_id):
+
+        # Nome de um fato para a justificativa: o nome do sintoma, ou o próprio ID para fatos derivados sem
+        # registro na base (ex.: "fonte suspeita").
+
+        symptom = self.engine._find_symptom(fact_id)
+        return symptom["name"] if "id" in symptom else str(fact_id)
     
     def run(self):
     
@@ -292,12 +2850,13 @@ class ConsoleUI:
             choice = input("Escolha uma opção: ")  # Recebe a escolha do usuário
 
             # Verifica qual opção o usuário escolheu
+            # Cada ação grava os dados no máximo uma vez, e apenas o que mudou (veja Persistence.deferred)
             if choice == "1":
-                self.consult()  # Chama o método de consulta de diagnóstico
-                self.persistence.save_all()  # Salva os dados após a consulta
+                self.consult()  # Chama o método de consulta de diagnóstico (o feedback já fica no log)
             elif choice == "2":
-                self.add_rule()  # Chama o método para adicionar nova solução, regra ou sintoma
-                self.persistence.save_all()  # Salva os dados após adicionar nova regra
+                with self.persistence.deferred():
+                    self.add_rule()  # Chama o método para adicionar nova solução, regra ou sintoma
+                    self.persistence.save_all()  # Salva os dados após adicionar nova regra
             elif choice == "3":
                 self.persistence.save_all()  # Salva os dados antes de sair
                 clear()  # Limpa a tela
@@ -362,6 +2921,7 @@ class ConsoleUI:
 
         # APLICA AS REGRAS / MATCH
         matches = self.engine.match_solutions(user_symptoms)  # Chama o motor de inferência para obter as soluções para os sintomas fornecidos
+        inference = self.engine.infer(user_symptoms)  # Fatos derivados pelo encadeamento, para a justificativa
 
         if not matches:
             clear()  # Limpa a tela
@@ -383,14 +2943,21 @@ class ConsoleUI:
             end = start + sol_page_size  # Índice final das soluções a serem exibidas
             page_items = matches[start:end]  # Obtém as soluções para a página atual
 
-            # Exibe as soluções sugeridas para o usuário
+            # Exibe os sintomas informados (justificativa da consulta) e as soluções sugeridas para o usuário
+            print("\nSintomas informados: " + ", ".join(self.engine._find_symptom(sid)["name"] for sid in user_symptoms))
+            if inference.derived:
+                print("Fatos derivados: " + ", ".join(self._fact_name(fid) for fid in inference.derived))
             print("\nSoluções sugeridas (p/ navegar: <  > / número para escolher / ENTER = nenhuma):\n")
 
             for i, m in enumerate(matches, 1):  # Itera sobre as soluções e exibe seus detalhes
                 print(f"\n{i}. Solução: {m['solution']}")  # Exibe o número e o nome da solução
                 print(f"   • Aderência (F1): {m['match']}")  # Exibe o score de aderência (F1)
                 print(f"   • Cobertura da regra: cobre {m['rule_precision']*100:.1f}% dos sintomas da regra")  # Exibe a cobertura da regra
-                print(f"   • Cobertura dos sintomas do usuário: cobre {m['user_recall']*100:.1f}% dos sintomas informados")  # Exibe a cobertura dos sintomas fornecidos pelo usuário
+                if inference.derived:
+                    # Com fatos derivados, o recall conta também os fatos derivados que a regra testa
+                    print(f"   • Cobertura dos fatos: cobre {m['user_recall']*100:.1f}% dos sintomas informados e dos fatos derivados testados pela regra")
+                else:
+                    print(f"   • Cobertura dos sintomas do usuário: cobre {m['user_recall']*100:.1f}% dos sintomas informados")  # Exibe a cobertura dos sintomas fornecidos pelo usuário
                 print(f"   • Precisão histórica: {m['precision']*100:.1f}%")  # Exibe a precisão histórica da solução
 
             print(f"\nPágina {sol_page+1}/{sol_total_pages}")  # Exibe a página atual e o total de páginas
@@ -429,26 +2996,26 @@ class ConsoleUI:
 
         if selected_solution:
             # Se o usuário escolheu uma solução, aplica o feedback positivo
-            self.engine.update_history(selected_solution["rule_id"], True)
+            updates = [(selected_solution["rule_id"], True, 0.1)]
 
             # Penaliza levemente as soluções não escolhidas
             for m in matches:
                 if m["rule_id"] != selected_solution["rule_id"]:
-                    self.engine.update_history(m["rule_id"], False, penalty_factor=0.1)
+                    updates.append((m["rule_id"], False, 0.1))
+            self.engine.update_history_many(updates)  # Um único snapshot novo para todo o feedback
+            self.persistence.record_feedback(updates)  # Acrescenta os eventos ao log de feedback
 
             print("\nFeedback registrado: solução escolhida recebeu reforço positivo.")  # Exibe mensagem de reforço positivo
             input("Pressione ENTER para continuar.")  # Aguarda o usuário pressionar ENTER para voltar
         else:
             # Se nenhuma solução foi escolhida, aplica penalização nas soluções sugeridas
-            for m in matches:
-                self.engine.update_history(m["rule_id"], False)
+            updates = [(m["rule_id"], False, 0.1) for m in matches]
+            self.engine.update_history_many(updates)
+            self.persistence.record_feedback(updates)  # Acrescenta os eventos ao log de feedback
 
             print("\nFeedback registrado: nenhuma solução válida, penalização aplicada a todas.")  # Exibe mensagem de penalização
             input("Pressione ENTER para continuar.")  # Aguarda o usuário pressionar ENTER para voltar
 
-        self.persistence.history = self.engine.history  # Atualiza o histórico de feedback
-        self.persistence.save_all()  # Salva os dados após o feedback
-
     def add_rule(self):
         
         # Método responsável por adicionar novos sintomas, soluções e regras à base de conhecimento.
@@ -476,8 +3043,8 @@ class ConsoleUI:
 
                 # Gera um novo ID para o sintoma
                 new_id = max([s["id"] for s in self.persistence.kb["symptoms"]], default=0) + 1
-                # Adiciona o novo sintoma à lista de sintomas
-                self.persistence.kb["symptoms"].append({"id": new_id, "name": name})
+                # Adiciona o novo sintoma à lista de sintomas (e ao índice de sintomas do motor)
+                self.engine.add_symptom({"id": new_id, "name": name})
                 new_symptom_ids.append(new_id)  # Armazena o ID do novo sintoma
                 print(f"Sintoma '{name}' adicionado com ID {new_id}")  # Exibe mensagem de sucesso
 
@@ -493,13 +3060,13 @@ class ConsoleUI:
         # Adicionando Nova Solução
         solution_name = input("Descrição da nova solução: ")  # Solicita a descrição da nova solução
         new_sol_id = max([s["id"] for s in self.persistence.kb["solutions"]], default=0) + 1  # Gera um novo ID para a solução
-        self.persistence.kb["solutions"].append({"id": new_sol_id, "name": solution_name})  # Adiciona a nova solução à lista de soluções
+        self.engine.add_solution({"id": new_sol_id, "name": solution_name})  # Adiciona a nova solução à lista de soluções (e ao índice do motor)
 
         
         # Criando Nova Regra
         new_rule_id = max([r["id"] for r in self.persistence.kb["rules"]], default=0) + 1  # Gera um novo ID para a regra
-        # Adiciona a nova regra à lista de regras
-        self.persistence.kb["rules"].append({
+        # Adiciona a nova regra pelo motor de inferência, que também atualiza o índice de sintomas
+        self.engine.add_rule({
             "id": new_rule_id,  # ID da nova regra
             "symptoms": symptom_ids,  # Lista de sintomas associados à regra
             "solution": new_sol_id  # ID da solução associada à regra
@@ -509,23 +3076,329 @@ class ConsoleUI:
         self.persistence.save_all()  # Salva os dados atualizados na persistência
 
 
-def main():
+# Benchmark da recuperação aproximada
+def benchmark_lsh(kb, history, queries, top_k=10, bands=64, rows=2):
+
+    # Compara o modo "lsh" com o caminho exato sobre um conjunto de consultas.
+    # :param queries: Lista de listas de IDs de sintomas.
+    # :return: Dicionário com o recall@k médio (fração das top_k regras exatas que o LSH também retornou)
+    #          e o tempo total de cada modo, em segundos.
+
+    exact = InferenceEngine(kb, history, cache_size=0)
+    approx = InferenceEngine(kb, history, cache_size=0, retrieval="lsh", lsh_bands=bands, lsh_rows=rows)
+
+    start = time.perf_counter()
+    exact_results = [exact.match_solutions(q, top_k=top_k) for q in queries]
+    exact_time = time.perf_counter() - start
+    start = time.perf_counter()
+    approx_results = [approx.match_solutions(q, top_k=top_k) for q in queries]
+    approx_time = time.perf_counter() - start
+
+    recalls = []
+    for expected, found in zip(exact_results, approx_results):
+        if expected:
+            found_ids = {m["rule_id"] for m in found}
+            recalls.append(sum(m["rule_id"] in found_ids for m in expected) / len(expected))
+
+    return {
+        "recall_at_k": sum(recalls) / len(recalls) if recalls else 1.0,
+        "exact_seconds": exact_time,
+        "lsh_seconds": approx_time,
+        "queries": len(queries),
+        "top_k": top_k
+    }
+
+# Serviço HTTP de diagnóstico
+# Servidor local (biblioteca padrão) que mantém um único motor de inferência carregado e responde em JSON.
+# Cada conexão é atendida por uma thread e pode ser reutilizada (HTTP/1.1 keep-alive); as consultas leem o
+# snapshot atual do motor sem trava, e o feedback é serializado pelo próprio motor.
+#   POST /diagnose        {"symptoms": [1, 2], "top_k": 5}            -> {"results": [...]}
+#   POST /diagnose/batch  {"queries": [[1, 2], [4]], "top_k": 5}      -> {"results": [[...], [...]]}
+#   POST /feedback        {"rule_id": 1, "success": true}             -> {"updated": 1, "version": ...}
+#                         ou {"events": [{"rule_id": 1, "success": false, "penalty_factor": 0.1}, ...]}
+
+class DiagnosisRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Mantém a conexão aberta entre requisições (keep-alive)
+    disable_nagle_algorithm = True  # Cabeçalhos e corpo saem em escritas separadas; sem isso cada resposta espera o ACK atrasado
+    max_body = 16 * 1024 * 1024  # Tamanho máximo aceito para o corpo da requisição (bytes)
+
+    def do_POST(self):
+        routes = {
+            "/diagnose": self._diagnose,
+            "/diagnose/batch": self._diagnose_batch,
+            "/feedback": self._feedback
+        }
+        route = routes.get(self.path.split("?", 1)[0].rstrip("/"))
+        try:
+            payload = self._read_json()  # Lê o corpo mesmo em rota inválida, para manter a conexão utilizável
+            if route is None:
+                self._send(404, {"error": f"Rota desconhecida: {self.path}"})
+                return
+            self._send(200, route(payload))
+        except (ValueError, TypeError) as exc:  # TypeError: valor de tipo inesperado que escapou da validação
+            self._send(400, {"error": str(exc)})
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            engine = self.server.engine
+            self._send(200, {"status": "ok", "version": engine.version, "cache": engine.cache.stats()})
+        else:
+            self._send(404, {"error": f"Rota desconhecida: {self.path}"})
+
+    def _diagnose(self, payload):
+        symptoms = self._symptoms(payload.get("symptoms"))
+        return {"results": self.server.engine.match_solutions(symptoms, top_k=self._top_k(payload))}
+
+    def _diagnose_batch(self, payload):
+        queries = payload.get("queries")
+        if not isinstance(queries, list):
+            raise ValueError('"queries" deve ser uma lista de listas de IDs de sintomas')
+        queries = [self._symptoms(symptoms) for symptoms in queries]
+        return {"results": self.server.engine.match_solutions_batch(queries, top_k=self._top_k(payload))}
+
+    def _feedback(self, payload):
+        events = payload.get("events", [payload])
+        if not isinstance(events, list):
+            raise ValueError('"events" deve ser uma lista de feedbacks')
+        updates = []
+        for event in events:
+            if not isinstance(event, dict) or not self._is_id(event.get("rule_id")) or not isinstance(event.get("success"), bool):
+                raise ValueError('Cada feedback precisa de "rule_id" (inteiro ou texto) e "success" (true/false)')
+            penalty_factor = event.get("penalty_factor", 0.1)
+            # Os contadores do histórico só crescem: a penalização precisa ser um número finito e não negativo
+            if (not isinstance(penalty_factor, (int, float)) or isinstance(penalty_factor, bool)
+                    or not math.isfinite(penalty_factor) or penalty_factor < 0):
+                raise ValueError('"penalty_factor" deve ser um número finito maior ou igual a zero')
+            updates.append((event["rule_id"], event["success"], float(penalty_factor)))
+        self.server.record_feedback(updates)
+        return {"updated": len(updates), "version": self.server.engine.version}
+
+    def _read_json(self):
+
+        # Lê e decodifica o corpo JSON da requisição (objeto vazio se não houver corpo).
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True  # O corpo não será lido: a conexão não pode ser reaproveitada
+            raise ValueError("Content-Length inválido")
+        if length > self.max_body:
+            self.close_connection = True
+            raise ValueError("Corpo da requisição muito grande")
+        body = self.rfile.read(length) if length else b""
+        if not body:
+            return {}
+        try:
+            payload = json.loads(body)
+        except (UnicodeDecodeError, json.JSONDecodeError) as exc:
+            raise ValueError(f"JSON inválido: {exc}")
+        if not isinstance(payload, dict):
+            raise ValueError("O corpo da requisição deve ser um objeto JSON")
+        return payload
+
+    @classmethod
+    def _symptoms(cls, symptoms):
+        if not isinstance(symptoms, list) or not all(map(cls._is_id, symptoms)):
+            raise ValueError('"symptoms" deve ser uma lista de IDs de sintomas (inteiros ou textos)')
+        return symptoms
+
+    @staticmethod
+    def _is_id(value):
+        return isinstance(value, (int, str)) and not isinstance(value, bool)
+
+    @staticmethod
+    def _top_k(payload):
+        top_k = payload.get("top_k")
+        if top_k is not None and (not isinstance(top_k, int) or isinstance(top_k, bool)):
+            raise ValueError('"top_k" deve ser um número inteiro')
+        return top_k
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))  # Obrigatório para o keep-alive
+        if self.close_connection:
+            self.send_header("Connection", "close")  # Avisa o cliente de que a conexão será encerrada
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Sem log por requisição no terminal (o custo de I/O domina o tempo de resposta)
+
+class DiagnosisServer(ThreadingHTTPServer):
+    daemon_threads = True  # Conexões abertas não impedem o encerramento do servidor
+
+    def __init__(self, address, persistence, engine):
+        super().__init__(address, DiagnosisRequestHandler)
+        self.persistence = persistence  # Persistência usada para salvar o histórico após o feedback
+        self.engine = engine  # Motor de inferência compartilhado por todas as conexões
+
+    def record_feedback(self, updates):
+
+        # Aplica o feedback no motor e o registra no log de feedback. O registro usa a trava de escrita do
+        # motor, para que o histórico não mude enquanto é compactado.
+
+        self.engine.update_history_many(updates)
+        with self.engine.lock:
+            self.persistence.record_feedback(updates)
+
+def serve(persistence, engine, host="127.0.0.1", port=8000):
+
+    # Inicia o serviço HTTP de diagnóstico e atende requisições até ser interrompido (Ctrl+C).
+
+    server = DiagnosisServer((host, port), persistence, engine)
+    print(f"Servidor de diagnóstico em http://{host}:{server.server_address[1]} (Ctrl+C para encerrar)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        with engine.lock:
+            persistence.save_all()  # Grava o que estiver pendente (no JSON, compacta o log de feedback)
+        persistence.close()
+
+# Diagnóstico em lote (JSONL)
+# Entrada: um chamado por linha, como lista de IDs de sintomas ([1, 2]) ou objeto ({"id": "T-1", "symptoms": [1, 2]}).
+# Saída: uma linha por chamado, na mesma ordem, com {"id": ..., "results": [...]} (ou {"line": n, "error": ...}
+# para linhas inválidas). As linhas são lidas e pontuadas em blocos (match_solutions_batch), então a memória
+# usada depende só do tamanho do bloco, não do tamanho do arquivo.
+
+def diagnose_jsonl(engine, infile, outfile, top_k=None, chunk_size=1000):
+
+    # Pontua os chamados de `infile` e escreve os resultados em `outfile`, bloco a bloco.
+    # :return: Número de chamados processados.
+
+    count = 0
+    lines = ((number, line) for number, line in enumerate(infile, 1) if line.strip())  # Ignora linhas em branco
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if not chunk:
+            return count
+
+        records = []  # Por linha: (ID do chamado, None, índice da consulta) ou (número da linha, erro, None)
+        queries = []
+        for number, line in chunk:
+            count += 1
+            try:
+                ticket = json.loads(line)
+                symptoms = ticket.get("symptoms") if isinstance(ticket, dict) else ticket
+                if not isinstance(symptoms, list):
+                    raise ValueError('esperado uma lista de IDs de sintomas ou um objeto com "symptoms"')
+                if not all(isinstance(sid, (int, str)) and not isinstance(sid, bool) for sid in symptoms):
+                    raise ValueError("os IDs de sintomas devem ser inteiros ou textos")
+            except ValueError as exc:  # json.JSONDecodeError também é ValueError
+                records.append((number, str(exc), None))
+                continue
+            records.append((ticket.get("id") if isinstance(ticket, dict) else None, None, len(queries)))
+            queries.append(symptoms)
+
+        results = engine.match_solutions_batch(queries, top_k=top_k)
+        out = []
+        for key, error, index in records:
+            if error is not None:
+                out.append({"line": key, "error": error})
+            elif key is not None:
+                out.append({"id": key, "results": results[index]})
+            else:
+                out.append({"results": results[index]})
+        outfile.write("".join(json.dumps(o, ensure_ascii=False) + "\n" for o in out))  # Uma escrita por bloco
+
+def fsync_policy(value):
+
+    # Converte o argumento --fsync: "always", "never" ou um intervalo em milissegundos.
+
+    if value in ("always", "never"):
+        return value
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError('use "always", "never" ou um número de milissegundos')
+
+def main(argv=None):
     
     # Função principal que configura os componentes do sistema e inicia a execução do programa.
     # Ela cria as instâncias necessárias da persistência, motor de inferência e interface de usuário,
     # e chama o método 'run()' para iniciar a interação com o usuário.
-    
+    # Com o subcomando "serve", inicia o serviço HTTP de diagnóstico em vez da interface de texto.
+    # :param argv: Argumentos de linha de comando (padrão: sys.argv[1:]).
+
+    parser = argparse.ArgumentParser(description="Sistema especialista para diagnóstico de falhas em computadores")
+    parser.add_argument("--kb", default="kb.json", help="Arquivo da base de conhecimento")
+    parser.add_argument("--history", default="history.json", help="Arquivo do histórico de feedback")
+    parser.add_argument("--backend", choices=["python", "numpy"], default="python", help="Backend de pontuação")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json", help="Backend de persistência")
+    parser.add_argument("--db", default="kb.db", help="Arquivo do banco SQLite (com --storage sqlite)")
+    parser.add_argument("--write-behind", action="store_true", help="Grava o feedback em segundo plano (thread de gravação)")
+    parser.add_argument("--fsync", type=fsync_policy, default=None,
+                        help='Política de fsync: "always", "never" ou um intervalo em milissegundos')
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Partições do motor de inferência, cada uma em um processo (1 = motor em um único processo)")
+    commands = parser.add_subparsers(dest="command")
+    serve_parser = commands.add_parser("serve", help="Inicia o serviço HTTP de diagnóstico")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Endereço de escuta")
+    serve_parser.add_argument("--port", type=int, default=8000, help="Porta de escuta")
+    diagnose_parser = commands.add_parser("diagnose", help="Diagnostica chamados em lote (JSONL na entrada e na saída)")
+    diagnose_parser.add_argument("--input", default="-", help="Arquivo JSONL de chamados (padrão: entrada padrão)")
+    diagnose_parser.add_argument("--top-k", type=int, default=None, help="Número de soluções por chamado")
+    diagnose_parser.add_argument("--chunk-size", type=int, default=1000, help="Chamados pontuados por bloco")
+    commands.add_parser("migrate", help="Importa kb.json e history.json (--kb/--history) para o banco SQLite (--db)")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        source = Persistence(args.kb, args.history, compiled_kb=False, read_only=True)  # Inclui o feedback ainda não compactado do log
+        store = SQLiteStore(args.db)
+        store.import_all(source.kb, source.history)
+        store.close()
+        print(f"{len(source.kb['rules'])} regras e {len(source.history)} registros de histórico importados para {args.db}")
+        return
+
     # Inicializa a persistência dos dados
-    persistence = Persistence()  # Cria uma instância da classe Persistence para carregar os dados da base de conhecimento (kb.json) e histórico (history.json)
+    persistence = Persistence(args.kb, args.history, backend=args.storage, db_file=args.db,
+                              write_behind=args.write_behind, fsync=args.fsync,
+                              read_only=args.command == "diagnose")  # Cria uma instância da classe Persistence para carregar os dados da base de conhecimento (kb.json) e histórico (history.json)
 
     # Inicializa o motor de inferência
-    engine = InferenceEngine(persistence.kb, persistence.history)  # Cria uma instância da classe InferenceEngine com a base de conhecimento e histórico carregados
+    if args.shards > 1:
+        # Motor particionado: as regras pontuadas ficam em `shards` processos (veja ShardedInferenceEngine)
+        kb = persistence.kb if persistence.compiled is None else None
+        engine = ShardedInferenceEngine(kb, persistence.load_history, shards=args.shards, backend=args.backend,
+                                        compiled=persistence.compiled)
+    elif persistence.compiled is not None:
+        # Monta o motor direto da base compilada (kb.bin); o kb.json só é lido se a base for alterada ou exibida
+        engine = InferenceEngine(None, persistence.load_history, backend=args.backend, compiled=persistence.compiled)
+    else:
+        engine = InferenceEngine(persistence.kb, persistence.load_history, backend=args.backend)  # Cria uma instância da classe InferenceEngine com a base de conhecimento e histórico carregados
+
+    try:
+        if args.command == "serve":
+            serve(persistence, engine, args.host, args.port)  # Atende requisições HTTP com o motor já carregado
+            return
+        if args.command == "diagnose":
+            infile = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+            try:
+                diagnose_jsonl(engine, infile, sys.stdout, args.top_k, max(args.chunk_size, 1))
+                sys.stdout.flush()
+            except BrokenPipeError:
+                # A saída foi fechada antes do fim (ex.: "| head"): encerra sem erro
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            finally:
+                if infile is not sys.stdin:
+                    infile.close()
+            return
 
-    # Inicializa a interface do usuário
-    ui = ConsoleUI(persistence, engine)  # Cria uma instância da classe ConsoleUI, passando a persistência e o motor de inferência
+        # Inicializa a interface do usuário
+        ui = ConsoleUI(persistence, engine)  # Cria uma instância da classe ConsoleUI, passando a persistência e o motor de inferência
 
-    # Inicia a execução do sistema
-    ui.run()  # Chama o método run da classe ConsoleUI, que entra no loop de interação com o usuário
+        # Inicia a execução do sistema
+        ui.run()  # Chama o método run da classe ConsoleUI, que entra no loop de interação com o usuário
+        persistence.close()  # Encerra a thread de gravação (modo write-behind) e fecha os arquivos
+    finally:
+        if args.shards > 1:
+            engine.close()  # Encerra os processos das partições
 
 # Se o script for executado diretamente (não importado como módulo), chama a função main()
 if __name__ == "__main__":
@@ -0,0 +1,52 @@
+# Testes do motor de inferência com regras de encadeamento (fatos derivados)
+# Execução (na pasta project): python -m pytest tests
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine as E
+
+
+def _kb(*rules):
+    return {
+        "symptoms": [{"id": i, "name": f"sintoma {i}"} for i in range(1, 5)],
+        "solutions": [{"id": i, "name": f"solução {i}"} for i in range(1, 4)],
+        "rules": [
+            {"id": 1, "symptoms": [1, 2], "solution": 1},
+            {"id": 2, "symptoms": ["fonte", 3], "solution": 2},
+            *rules,
+        ],
+    }
+
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+def test_chaining_rule_mixing_derived_fact_and_symptom(backend):
+    kb = _kb({"id": 10, "symptoms": [1], "asserts": ["fonte"]},
+             {"id": 11, "symptoms": ["fonte", 3], "asserts": ["queimada"]},
+             {"id": 12, "symptoms": ["queimada"], "solution": 3})
+    engine = E.InferenceEngine(kb, {}, backend=backend)
+    engine.add_rule({"id": 13, "symptoms": [4, "queimada"], "asserts": ["troca"]})
+
+    memory = engine.infer([1, 3])
+    assert memory.derived == ["fonte", "queimada"]
+    assert {m["rule_id"] for m in engine.match_solutions([1, 3])} == {1, 2, 12}
+
+
+@pytest.mark.parametrize("backend", ["python", "numpy"])
+def test_unrelated_derived_fact_does_not_change_recall(backend):
+    plain = E.InferenceEngine(_kb(), {}, backend=backend)
+    chained = E.InferenceEngine(_kb({"id": 10, "symptoms": [], "asserts": ["sempre"]}), {}, backend=backend)
+
+    # A regra 1 não testa o fato derivado: a pontuação é a mesma com ou sem a regra de encadeamento
+    assert chained.match_solutions([1, 2, 3]) == plain.match_solutions([1, 2, 3])
+
+    # A regra 2 testa o fato derivado "fonte": ele conta na interseção e no recall dela
+    kb = _kb({"id": 10, "symptoms": [1], "asserts": ["fonte"]})
+    result = {m["rule_id"]: m for m in E.InferenceEngine(kb, {}, backend=backend).match_solutions([1, 2, 3])}
+    assert result[1]["user_recall"] == round(2 / 3, 4)
+    assert result[2]["user_recall"] == round(2 / 4, 4)
+    assert result[2]["rule_precision"] == 1.0
@@ -0,0 +1,122 @@
+# Testes da persistência: histórico com vários processos gravando feedback no mesmo history.json e gravação da base
+# Execução (na pasta project): python -m pytest tests
+
+import json
+import multiprocessing
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import engine as E
+
+
+def _worker(i, n, write_behind):
+
+    # Processo que grava `n` feedbacks aleatórios, com compactações no meio.
+    # :return: Totais enviados por regra: ID da regra -> [sucesso, falha].
+
+    rng = random.Random(i)
+    p = E.Persistence('kb.json', 'history.json', compact_every=rng.choice([5, 17, 50]),
+                      write_behind=write_behind, flush_threshold=8)
+    sent = {}
+    for _ in range(n):
+        rid = rng.randint(1, 20)
+        ok = rng.random() < 0.5
+        p.record_feedback([(rid, ok, 0.25)])
+        totals = sent.setdefault(str(rid), [0, 0])
+        if ok:
+            totals[0] += 1
+        else:
+            totals[1] += 0.25
+        if rng.random() < 0.02:
+            p.compact()
+    if i % 2:
+        p.save_all()
+    p.close()
+    return sent
+
+
+def _assert_totals(history, expected):
+    for rid, (success, fail) in expected.items():
+        assert history[rid]["success"] == success, rid
+        assert abs(history[rid]["fail"] - fail) < 1e-9, rid
+
+
+def test_concurrent_writers_keep_all_feedback(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    E.Persistence('kb.json', 'history.json').close()
+    with open('history.json', 'w') as f:
+        json.dump({"1": {"success": 3, "fail": 1}}, f)
+
+    with multiprocessing.Pool(8) as pool:
+        results = pool.starmap(_worker, [(i, 400, i % 3 == 0) for i in range(8)])
+    expected = {"1": [3, 1]}
+    for sent in results:
+        for rid, (success, fail) in sent.items():
+            totals = expected.setdefault(rid, [0, 0])
+            totals[0] += success
+            totals[1] += fail
+
+    _assert_totals(E.Persistence('kb.json', 'history.json', read_only=True).history, expected)
+    p = E.Persistence('kb.json', 'history.json')
+    p.compact()
+    p.close()
+    with open('history.json') as f:
+        _assert_totals(json.load(f), expected)
+
+
+def test_torn_line_from_dead_writer_keeps_feedback(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    b = E.Persistence('kb.json', 'history.json', writer_id="B")
+    b.load_history()
+    with open('history.log', 'a') as f:
+        f.write('["1","A",2,0,')  # Processo A parou no meio da gravação
+    b.record_feedback([(2, True, 0.1)])
+    b.record_feedback([(3, False, 0.5)])
+
+    # Outro processo carrega o log: a linha interrompida é ignorada e as de B continuam no arquivo
+    c = E.Persistence('kb.json', 'history.json', writer_id="C")
+    assert c.history["2"] == {"success": 1, "fail": 0}
+    assert c.history["3"] == {"success": 0, "fail": 0.5}
+    c.close()
+
+    b.compact()
+    b.close()
+    with open('history.json') as f:
+        history = json.load(f)
+    assert history["2"] == {"success": 1, "fail": 0}
+    assert history["3"] == {"success": 0, "fail": 0.5}
+    assert "1" not in history
+
+
+def test_torn_final_line_is_truncated(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    a = E.Persistence('kb.json', 'history.json', writer_id="A")
+    a.record_feedback([(4, True, 0.1)])
+    a.close()
+    with open('history.log', 'a') as f:
+        f.write('["4","A",2,0,')
+    b = E.Persistence('kb.json', 'history.json', writer_id="B")
+    assert b.history["4"] == {"success": 1, "fail": 0}
+    b.close()
+    with open('history.log', 'rb') as f:
+        assert f.read().endswith(b"\n")
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_edited_rule_is_saved(tmp_path, monkeypatch, backend):
+    monkeypatch.chdir(tmp_path)
+    p = E.Persistence(backend=backend)
+    p.kb["rules"][0]["symptoms"] = [1, 2, 3]
+    p.kb["rules"].append({"id": 99, "symptoms": ["fonte"], "asserts": ["queimada"]})
+    p.mark_dirty("kb")
+    p.save_all()
+    p.close()
+
+    kb = E.Persistence(backend=backend).kb
+    assert kb["rules"][0]["symptoms"] == [1, 2, 3]
+    assert kb["rules"][-1] == {"id": 99, "symptoms": ["fonte"], "asserts": ["queimada"]}